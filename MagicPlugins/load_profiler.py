@@ -0,0 +1,191 @@
+"""
+MagicPlugins by Gilles Vink
+
+Profiling how long it takes to create plugins
+
+When profiling is enabled, every node created from the MagicPlugins menu
+is timed. The last timings of every plugin are saved in a local file, so
+we can see which plugins are slow to create over multiple sessions.
+
+"""
+
+import json
+import os
+import time
+
+import plugin_index
+
+
+def get_default_store_path():
+    store_path = os.path.join(
+        os.path.expanduser("~"), ".nuke", "magic_plugins_profile.json"
+    )
+    return store_path.replace(os.sep, "/")
+
+
+class LoadProfiler(object):
+    """Keeps the last timings for every plugin in a JSON file, like:
+
+    profile = {
+        "MagicTool": {
+            "count": 12,
+            "file_size": 1024,
+            "samples": [{"time": 1660000000.0, "wall_time": 0.2,
+                         "first": True}]
+        }
+    }"""
+
+    def __init__(self, store_path=None, max_samples=20):
+        if store_path is None:
+            store_path = get_default_store_path()
+
+        self.store_path = store_path
+        self.max_samples = max_samples
+
+    def record(self, plugin_name, wall_time, first, file_size=None):
+        """Add a timing for the plugin. First means it is the first time
+        the plugin is created in this session."""
+
+        # Other sessions might have saved timings as well, so always
+        # read the latest profile before adding ours
+        profile = self.load()
+
+        plugin_profile = profile.setdefault(
+            plugin_name, {"count": 0, "file_size": None, "samples": []}
+        )
+        plugin_profile["count"] += 1
+        if file_size is not None:
+            plugin_profile["file_size"] = file_size
+
+        samples = plugin_profile.get("samples")
+        samples.append(
+            {"time": time.time(), "wall_time": wall_time, "first": first}
+        )
+
+        # Only keep the latest timings
+        del samples[: -self.max_samples]
+
+        self.__save(profile)
+
+    def load(self):
+        try:
+            with open(self.store_path, "r") as store_file:
+                return json.load(store_file)
+
+        # No profile yet, or it is damaged
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def get_usage_counts(self):
+        """Return how many times every plugin has been created"""
+
+        return dict(
+            (plugin_name, plugin_profile.get("count", 0))
+            for plugin_name, plugin_profile in self.load().items()
+        )
+
+    def get_summary(self, limit=20):
+        """Return the slowest plugins, slowest first. The plugins are
+        sorted by the average time of the first creation in a session,
+        because that's when the files are loaded."""
+
+        summary = []
+
+        for plugin_name, plugin_profile in self.load().items():
+            samples = plugin_profile.get("samples", [])
+            first_times = [
+                sample.get("wall_time")
+                for sample in samples
+                if sample.get("first")
+            ]
+            repeat_times = [
+                sample.get("wall_time")
+                for sample in samples
+                if not sample.get("first")
+            ]
+
+            summary.append(
+                {
+                    "plugin_name": plugin_name,
+                    "count": plugin_profile.get("count", 0),
+                    "file_size": plugin_profile.get("file_size"),
+                    "first_time": self.__get_average(first_times),
+                    "repeat_time": self.__get_average(repeat_times),
+                    "max_time": max(
+                        [sample.get("wall_time") for sample in samples]
+                        or [0.0]
+                    ),
+                }
+            )
+
+        summary.sort(
+            key=lambda plugin_summary: (
+                plugin_summary.get("first_time") or 0.0,
+                plugin_summary.get("max_time"),
+            ),
+            reverse=True,
+        )
+
+        return summary[:limit]
+
+    def format_summary(self, limit=20):
+        """The summary as readable text"""
+
+        lines = [
+            "%-32s %8s %10s %10s %10s"
+            % ("Plugin", "Created", "First (s)", "Repeat (s)", "Size (MB)")
+        ]
+
+        for plugin_summary in self.get_summary(limit):
+            file_size = plugin_summary.get("file_size")
+            lines.append(
+                "%-32s %8i %10s %10s %10s"
+                % (
+                    plugin_summary.get("plugin_name")[:32],
+                    plugin_summary.get("count"),
+                    self.__format_number(plugin_summary.get("first_time")),
+                    self.__format_number(plugin_summary.get("repeat_time")),
+                    self.__format_number(
+                        None
+                        if file_size is None
+                        else file_size / (1024.0 * 1024.0)
+                    ),
+                )
+            )
+
+        return "\n".join(lines)
+
+    def __save(self, profile):
+        """Write to a temporary file first, so other sessions will never
+        read a half written profile"""
+
+        store_directory = os.path.dirname(self.store_path)
+        temporary_path = "%s.%i.tmp" % (self.store_path, os.getpid())
+
+        try:
+            if store_directory and not os.path.isdir(store_directory):
+                os.makedirs(store_directory)
+
+            with open(temporary_path, "w") as store_file:
+                json.dump(profile, store_file)
+
+            plugin_index.replace_file(temporary_path, self.store_path)
+
+        # Profiling should never break creating nodes
+        except (IOError, OSError):
+            if os.path.isfile(temporary_path):
+                os.remove(temporary_path)
+
+    @staticmethod
+    def __get_average(values):
+        if not values:
+            return None
+
+        return sum(values) / float(len(values))
+
+    @staticmethod
+    def __format_number(value):
+        if value is None:
+            return "-"
+
+        return "%.3f" % value
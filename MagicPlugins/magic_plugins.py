@@ -8,13 +8,22 @@ and create menus
 
 import os
 import sys
+import threading
+import time
 import nuke
+from collections import OrderedDict
+import load_profiler
+import plugin_index
+import read_ahead
+import scan_cache
 
 
 # Only load if we have a GUI
 if nuke.GUI:
     import install_plugin_dialog
-    from shutil import copy2
+    import menu_reconciler
+    import plugin_installer
+    import plugin_repository
 
 
 class MagicPlugins(object):
@@ -50,15 +59,93 @@ class MagicPlugins(object):
         # Getting operating system to determine library extension
         # and to call the folder open function
         self.operating_system = sys.platform
+
+        # The catalogue is built offline by the plugin_index command, when
+        # it is available we don't need to scan the plugins directory
+        self.plugin_index = plugin_index.PluginIndex(self.plugins_directory)
+
+        # Without a catalogue, sessions starting at the same moment on
+        # the same machine share one scan. The amount of seconds a scan
+        # can be reused can be set with the environment variable, 0
+        # disables sharing scans.
+        self.scan_cache = scan_cache.SharedScanCache(
+            self.plugins_directory,
+            max_age=self.__get_number_setting(
+                "MAGIC_PLUGINS_SCAN_CACHE_MAX_AGE", 300
+            ),
+        )
+
         # Always collect all the plugins when this script is initialized
-        self.plugins = self.__locate_plugins(self.plugins_directory)
+        (
+            self.plugins,
+            self.categories,
+            self.dependencies,
+        ) = self.__load_index()
+
+        # Without a catalogue (or when a gizmo changed after it was built)
+        # the dependencies are found once a plugin is created, these are
+        # the plugins we already checked
+        self.found_dependencies = {}
+
+        # The plugins we prefetched already, and don't need to again
+        self.prefetched_plugins = set()
+        self.prefetch_thread_count = 4
+        self.prefetch_timeout = 10.0
+
+        # Optionally the libraries are read in the background after
+        # loading, so creating the first node doesn't need to wait for the
+        # network. The budget is in megabytes, the categories are read
+        # first (comma separated, like "Internet/Keyer,Color").
+        self.read_ahead_enabled = (
+            os.environ.get("MAGIC_PLUGINS_READ_AHEAD", "0") == "1"
+        )
+        self.read_ahead_budget = self.__get_number_setting(
+            "MAGIC_PLUGINS_READ_AHEAD_BUDGET", 512, int
+        )
+        self.read_ahead_rate = self.__get_number_setting(
+            "MAGIC_PLUGINS_READ_AHEAD_RATE", 32
+        )
+        self.read_ahead_categories = [
+            category
+            for category in os.environ.get(
+                "MAGIC_PLUGINS_READ_AHEAD_CATEGORIES", ""
+            ).split(",")
+            if category
+        ]
+        self.read_ahead = None
+
+        # When profiling is enabled, creating plugins from the menu is timed
+        # and saved, so we can see which plugins are slow to create
+        self.load_profiler = None
+        if os.environ.get("MAGIC_PLUGINS_PROFILE", "0") == "1":
+            self.load_profiler = load_profiler.LoadProfiler(
+                os.environ.get("MAGIC_PLUGINS_PROFILE_PATH")
+            )
+
+        # The plugins created in this session, to know if it is the
+        # first time a plugin is created
+        self.created_plugins = set()
+
+        # The JSON catalogue of a plugin repository we can install from
+        self.repository_url = os.environ.get("MAGIC_PLUGINS_REPOSITORY_URL")
 
         # This is the name we use for our menu in Nuke
         self.menu_name = "MagicPlugins"
 
+        # Categories with more plugins than this are split into
+        # alphabetical sub menus, because huge menus are slow in Qt
+        self.max_menu_items = self.__get_number_setting(
+            "MAGIC_PLUGINS_MAX_MENU_ITEMS", 100, int
+        )
+
         # These are the plugins we would call library
         self.library_extensions = (".dll", ".so", ".dylib")
 
+        # Keeps track of what we added to the menu, so refreshing the menu
+        # only applies the changes
+        if nuke.GUI:
+            self.menu_reconciler = menu_reconciler.MenuReconciler()
+
     def load_plugins(self):
         """We will always use this function to load plugins
         in the init.py file"""
@@ -67,6 +154,9 @@ class MagicPlugins(object):
         self.__print("Loading all plugins")
         added_directories = []
 
+        # Let the artist know about plugins that will fail to create
+        self.__report_dependencies()
+
         for plugin in self.plugins:
             file_path = plugin.get("file_path")
             plugin_directory = os.path.dirname(file_path)
@@ -77,25 +167,185 @@ class MagicPlugins(object):
 
         self.__print("Loaded plugins")
 
+        if self.read_ahead_enabled:
+            # With profiling we know which plugins are used the most
+            usage_counts = None
+            if self.load_profiler is not None:
+                usage_counts = self.load_profiler.get_usage_counts()
+
+            self.start_read_ahead(usage_counts)
+
+    def start_read_ahead(self, usage_counts=None):
+        """Read the libraries for this Nuke version in the background,
+        so the operating system has them in memory when Nuke loads them.
+        The most used plugins are read first, when usage is provided."""
+
+        self.cancel_read_ahead()
+
+        libraries = [
+            plugin
+            for plugin in self.plugins
+            if plugin.get("plugin_type") in plugin_index.LIBRARY_TYPES
+        ]
+        libraries = read_ahead.order_plugins(
+            libraries, usage_counts, self.read_ahead_categories
+        )
+
+        self.read_ahead = read_ahead.ReadAhead(
+            [plugin.get("file_path") for plugin in libraries],
+            byte_budget=self.read_ahead_budget * 1024 * 1024,
+            bytes_per_second=self.read_ahead_rate * 1024 * 1024 or None,
+        )
+        self.read_ahead.start()
+
+        self.__print("Reading %i libraries in the background" % len(libraries))
+
+    def cancel_read_ahead(self):
+        if self.read_ahead is not None:
+            self.read_ahead.cancel()
+            self.read_ahead = None
+
     def build_menu(self):
         """We will use this function in the menu.py file
         to build the menus in the UI"""
 
         self.__print("Adding plugins to menu")
 
+        self.__update_menu()
+
+        self.__print("Done, menu builded and populated with plugins :)")
+
+    def rescan(self):
+        """Scan the plugins directory again (or load the catalogue if it
+        has been rebuilt), and only add the changes to the menu"""
+
+        self.__print("Rescanning plugins")
+
+        current_directories = set(
+            os.path.dirname(plugin.get("file_path")) for plugin in self.plugins
+        )
+
+        # We don't want a shared scan here, as that might be older
+        if self.plugin_index.is_current():
+            (
+                self.plugins,
+                self.categories,
+                self.dependencies,
+            ) = self.__load_index()
+
+        else:
+            scan = self.__scan_plugins_directory()
+            self.plugins = scan.get("plugins")
+            self.categories = scan.get("categories")
+            self.dependencies = None
+
+        # Plugins might have been changed, so look for dependencies again
+        # and read them again when they are created
+        self.found_dependencies = {}
+        self.prefetched_plugins = set()
+
+        # Make sure Nuke can find plugins in new folders
+        for plugin in self.plugins:
+            plugin_directory = os.path.dirname(plugin.get("file_path"))
+            if plugin_directory not in current_directories:
+                nuke.pluginAddPath(plugin_directory)
+                current_directories.add(plugin_directory)
+
+        self.__update_menu()
+
+    def __update_menu(self):
+        """Build the desired menu from the collected plugins and apply
+        only the differences with the current menu"""
+
         # Defining the toolbar to add menus to
         magic_toolbar = nuke.toolbar("Nodes")
 
-        # Getting the collected plugins
-        plugins = self.plugins
+        # Here we collect all menu items, before adding them to the toolbar
+        desired_menu = OrderedDict()
 
         # Via the create menu function we will build the folders in the menu
-        self.__create_menus(magic_toolbar, plugins)
+        self.__create_menus(desired_menu, self.categories)
 
         # Via the populate menu function we will add the plugins in the menu
-        self.__populate_menu(magic_toolbar, plugins)
+        self.__populate_menu(desired_menu, self.plugins)
 
-        self.__print("Done, menu builded and populated with plugins :)")
+        # Split the big categories, the main menu with our commands is
+        # always kept as it is
+        if self.max_menu_items > 0:
+            desired_menu = menu_reconciler.split_menu(
+                desired_menu, self.max_menu_items, (self.menu_name,)
+            )
+
+        added_count, removed_count = self.menu_reconciler.apply(
+            magic_toolbar, desired_menu
+        )
+        self.__print(
+            "Added %i and removed %i menu items" % (added_count, removed_count)
+        )
+
+    def create_plugin(self, plugin_name):
+        """Used by the menu to create a node, the plugins it uses
+        inside are prefetched first"""
+
+        start_time = time.time()
+
+        self.__prefetch_dependencies(plugin_name)
+        node = nuke.createNode(plugin_name)
+
+        self.__record_load_time(plugin_name, start_time)
+
+        return node
+
+    def paste_plugin(self, file_path):
+        """Used by the menu to paste a .nk file, the plugins it uses
+        inside are prefetched first"""
+
+        start_time = time.time()
+
+        plugin_name = os.path.splitext(os.path.basename(file_path))[0]
+        self.__prefetch_dependencies(plugin_name)
+        node = nuke.nodePaste(file_path)
+
+        self.__record_load_time(plugin_name, start_time)
+
+        return node
+
+    def show_load_profile(self):
+        """Show the plugins that are the slowest to create"""
+
+        if self.load_profiler is None:
+            nuke.message(
+                "Profiling is disabled, set MAGIC_PLUGINS_PROFILE=1 "
+                "to enable it"
+            )
+            return
+
+        summary = self.load_profiler.format_summary()
+        self.__print("Slowest plugins to create\n%s" % summary)
+        nuke.message("<pre>%s</pre>" % summary)
+
+    def __record_load_time(self, plugin_name, start_time):
+        """Save how long it took to create the plugin, when profiling"""
+
+        if self.load_profiler is None:
+            return
+
+        wall_time = time.time() - start_time
+
+        first = plugin_name not in self.created_plugins
+        self.created_plugins.add(plugin_name)
+
+        file_size = None
+        for plugin in self.plugins:
+            if plugin.get("plugin_name") == plugin_name:
+                try:
+                    file_size = os.path.getsize(plugin.get("file_path"))
+
+                except OSError:
+                    pass
+                break
+
+        self.load_profiler.record(plugin_name, wall_time, first, file_size)
 
     def install_plugin(self):
         """Using this function the user can install plugins
@@ -122,7 +372,8 @@ class MagicPlugins(object):
                 if file_path.endswith((".dll", ".so", ".dylib")):
                     nuke_version = plugin_dialog.library_nuke_version.value()
 
-                # Installing plugin
+                # Installing plugin, this happens in the background so
+                # we only get a message when the installation is aborted
                 installation = self.__install_to_plugins(
                     plugin_path=file_path,
                     category=category,
@@ -131,8 +382,9 @@ class MagicPlugins(object):
                     nuke_version=nuke_version,
                 )
 
-                nuke.message(installation)
-                self.__print(installation)
+                if installation is not None:
+                    nuke.message(installation)
+                    self.__print(installation)
 
             # If no file is selected, let user know
             else:
@@ -140,11 +392,190 @@ class MagicPlugins(object):
 
             return
 
+    def install_from_repository(self, plugin_names=None, url=None):
+        """Download and install plugins from the plugin repository. If no
+        plugin names are provided, the user can pick them from the plugins
+        in the repository.
+
+        Everything is downloaded in the background, and the menu is
+        updated once when all plugins are installed."""
+
+        repository = plugin_repository.PluginRepository(
+            url or self.repository_url, self.plugins_directory
+        )
+
+        # Nuke shows the progress in its progress panel, where the artist
+        # can cancel the installation as well. The panel closes when the
+        # task is deleted, so we keep it in a dictionary we can clear.
+        progress = {}
+        cancelled = threading.Event()
+
+        def report_progress(message, done, total):
+            progress_task = progress.get("task")
+            if progress_task is None:
+                return
+
+            if progress_task.isCancelled():
+                cancelled.set()
+
+            progress_task.setMessage(message)
+            if total:
+                progress_task.setProgress(int(done * 100 / total))
+
+        def install():
+            install_error = None
+            install_paths = []
+
+            try:
+                install_paths = self.__install_repository_plugins(
+                    repository,
+                    plugin_names,
+                    progress,
+                    report_progress,
+                    cancelled,
+                )
+
+            except Exception as error:
+                install_error = error
+
+            # The menu can only be updated from the main thread
+            nuke.executeInMainThread(
+                self.__finish_repository_installation,
+                args=(install_error, progress, install_paths),
+            )
+
+        # Even getting the catalogue can take a while, so everything
+        # happens in the background
+        install_thread = threading.Thread(target=install)
+        install_thread.daemon = True
+        install_thread.start()
+
+        self.__print("Installing from %s" % repository.url)
+
+    def __install_repository_plugins(
+        self, repository, plugin_names, progress, report_progress, cancelled
+    ):
+        """Called on a background thread. The questions for the artist
+        are asked on the main thread, while we wait for the answers."""
+
+        if plugin_names is None:
+            repository_plugins = repository.get_plugins()
+
+            answer = nuke.executeInMainThreadWithResult(
+                nuke.getInput,
+                args=(
+                    "Plugins to install (comma separated)",
+                    ", ".join(
+                        sorted(
+                            plugin.get("name") for plugin in repository_plugins
+                        )
+                    ),
+                ),
+            )
+            if not answer:
+                raise plugin_installer.InstallCancelled(
+                    "Installation aborted"
+                )
+
+            plugin_names = [
+                name.strip() for name in answer.split(",") if name.strip()
+            ]
+
+        files = repository.get_install_files(plugin_names)
+
+        # If plugins already exist, ask the user if overwrite is desired
+        existing_paths = [
+            install_path
+            for _, install_path in files
+            if os.path.isfile(install_path)
+        ]
+        if existing_paths and not nuke.executeInMainThreadWithResult(
+            nuke.ask,
+            args=(
+                "%i files of these plugins are already installed, "
+                "do you want to overwrite them?" % len(existing_paths),
+            ),
+        ):
+            raise plugin_installer.InstallCancelled("Installation aborted")
+
+        self.__print("Installing %s" % ", ".join(plugin_names))
+
+        progress["task"] = nuke.ProgressTask("Installing plugins")
+        progress.get("task").setMessage("Downloading")
+
+        return repository.install_files(files, report_progress, cancelled)
+
+    def __finish_repository_installation(
+        self, install_error, progress, install_paths
+    ):
+        """Called on the main thread when all plugins from the repository
+        are installed. The menu is updated once for all plugins."""
+
+        # Closing the progress panel
+        progress.clear()
+
+        if isinstance(install_error, plugin_installer.InstallCancelled):
+            installation = str(install_error)
+
+        elif install_error is not None:
+            installation = "Something went wrong... %s" % str(install_error)
+
+        else:
+            library_extension = plugin_index.get_library_extension(
+                self.operating_system
+            )
+
+            # Only the plugins we can load in this Nuke version
+            file_paths = [
+                file_path
+                for file_path in install_paths
+                if file_path.endswith(plugin_index.BASIC_EXTENSIONS)
+                or (
+                    file_path.endswith(library_extension)
+                    and plugin_index.validate_plugin(
+                        file_path, self.nuke_version
+                    )
+                )
+            ]
+
+            for plugin_directory in sorted(
+                set(os.path.dirname(file_path) for file_path in file_paths)
+            ):
+                nuke.pluginAddPath(plugin_directory)
+
+            self.__add_plugins_to_menu(file_paths)
+
+            installation = "Installation successful for %i plugins" % len(
+                file_paths
+            )
+
+        nuke.message(installation)
+        self.__print(installation)
+
     @staticmethod
     def __print(text):
         message = "[MagicPlugins] %s" % text
         print(message)
 
+    def __get_number_setting(self, name, default, number_type=float):
+        """Read a number from an environment variable. A wrong value
+        should never prevent loading the plugins, so we fall back to the
+        default and let the artist know."""
+
+        value = os.environ.get(name)
+        if value is None:
+            return default
+
+        try:
+            return number_type(value)
+
+        except ValueError:
+            self.__print(
+                "%s should be a number, not %r. Using %s instead."
+                % (name, value, default)
+            )
+            return default
+
     def __install_to_plugins(
         self,
         plugin_path,
@@ -155,7 +586,11 @@ class MagicPlugins(object):
     ):
         """This function contains all the logic to copy the
         provided tool to the correct folder and ingest it into the
-        Nuke menu so the artist can use it."""
+        Nuke menu so the artist can use it.
+
+        The files are copied on a background thread, so Nuke won't freeze
+        while copying big files. When the copy is done, the plugin is added
+        to the menu on the main thread."""
 
         # Extract the plugin name, so we can use it for the name in Nuke
         plugin_name = os.path.basename(plugin_path)
@@ -185,6 +620,7 @@ class MagicPlugins(object):
 
         # If an icon path is provided, we will build the installation
         # path for that one too
+        icon_install_path = None
         if icon_path is not None:
             # Basically we will just get the name from the plugin, and replace
             # the extension with png, so it matches the plugin name
@@ -201,94 +637,120 @@ class MagicPlugins(object):
                 self.__print("Installation aborted")
                 return "Installation aborted"
 
-        try:
-            # Let's copy the plugin
-            copy2(plugin_path, plugin_install_path)
-            if icon_path is not None:
-                copy2(icon_path, icon_install_path)
-
-                # Prevent loading if it is not the correct Nuke version
-                if nuke_version:
-                    if not nuke_version == self.nuke_version:
-                        return "Installation successful for %s" % plugin_name
-
-                # Now we will add the plugin to the menu, here
-                # we will add the icon too
-                self.__add_plugin_to_menu(
-                    file_path=plugin_install_path,
-                    plugin_name=plugin_name,
-                    icon_path=icon_install_path,
+        # The icon is copied first, so it is available as soon as
+        # the plugin is in place
+        files = [(plugin_path, plugin_install_path)]
+        if icon_path is not None:
+            files.insert(0, (icon_path, icon_install_path))
+
+        # Nuke shows the progress in its progress panel, where the artist
+        # can cancel the installation as well. The panel closes when the
+        # task is deleted, so we keep it in a dictionary we can clear.
+        progress = {"task": nuke.ProgressTask("Installing %s" % plugin_name)}
+        progress.get("task").setMessage("Copying %s" % plugin_path)
+
+        def report_progress(copied_bytes, total_bytes):
+            progress_task = progress.get("task")
+            if progress_task.isCancelled():
+                installer.cancel()
+
+            if total_bytes:
+                progress_task.setProgress(
+                    int(copied_bytes * 100 / total_bytes)
                 )
 
-            else:
-
-                # Prevent loading if it is not the correct Nuke version
-                if nuke_version:
-                    if not nuke_version == self.nuke_version:
-                        return "Installation successful for %s" % plugin_name
+        # The menu can only be updated from the main thread
+        def finish_installation(error):
+            nuke.executeInMainThread(
+                self.__finish_installation,
+                args=(
+                    error,
+                    progress,
+                    plugin_install_path,
+                    plugin_name,
+                    install_directory,
+                    nuke_version,
+                ),
+            )
 
-                # Now we will add the plugin to the menu, without icon
-                self.__add_plugin_to_menu(
-                    file_path=plugin_install_path,
-                    plugin_name=plugin_name,
-                )
+        installer = plugin_installer.PluginInstaller(
+            files,
+            progress_callback=report_progress,
+            finished_callback=finish_installation,
+        )
+        installer.start()
 
-            # Append the plugin path to Nuke
-            nuke.pluginAddPath(install_directory)
+        self.__print("Installing %s" % plugin_name)
 
-            return "Installation successful for %s" % plugin_name
+    def __finish_installation(
+        self,
+        copy_error,
+        progress,
+        plugin_install_path,
+        plugin_name,
+        install_directory,
+        nuke_version,
+    ):
+        """Called on the main thread when the installer is done copying.
+        Here we add the plugin to the menu and let the artist know."""
 
-        # If something went wrong, we will catch the error here,
-        # and the artist will see it
-        except Exception as error:
-            return "Something went wrong... %s" % str(error)
+        # Closing the progress panel
+        progress.clear()
 
-    def __add_plugin_to_menu(self, file_path, plugin_name, icon_path=None):
-        """Basically the same as the populate menu function, except we
-        won't walk through a directory to add every plugin"""
+        try:
+            # If something went wrong while copying, we will show the error
+            if copy_error is not None:
+                raise copy_error
 
-        # Create the toolbar to add the node command to
-        magic_toolbar = nuke.toolbar("Nodes")
+            # Prevent loading if it is not the correct Nuke version
+            if not nuke_version or nuke_version == self.nuke_version:
+                # Now we will add the plugin to the menu, with the icon
+                # if it was installed
+                self.__add_plugins_to_menu([plugin_install_path])
 
-        # Node types where we use the createNode() function
-        node_types = (".gizmo", ".dll", ".dylib", ".so")
+                # Append the plugin path to Nuke
+                nuke.pluginAddPath(install_directory)
 
-        # Get the plugin category for the plugin given the file path
-        # so we can build the correct name in the menu
-        menu_name = self.__get_plugin_category(file_path)
+            installation = "Installation successful for %s" % plugin_name
 
-        # We need to scan every directory again to see new created directories
-        plugins = self.__locate_plugins(self.plugins_directory)
+        # The artist cancelled it from the progress panel
+        except plugin_installer.InstallCancelled:
+            installation = "Installation aborted"
 
-        # Build new menu's
-        self.__create_menus(magic_toolbar, plugins)
-
-        # If the current plugin is a node,
-        # like we specified in the node_types variable,
-        # build the createNode() function
-        if file_path.endswith(node_types):
-            magic_toolbar.addCommand(
-                menu_name,
-                "nuke.createNode('%s')" % plugin_name,
-                icon=icon_path,
-            )
+        # If something went wrong, we will catch the error here,
+        # and the artist will see it
+        except Exception as error:
+            installation = "Something went wrong... %s" % str(error)
+
+        nuke.message(installation)
+        self.__print(installation)
+
+    def __add_plugins_to_menu(self, file_paths):
+        """Add newly installed plugins to the collected plugins, and
+        update the menu. Only the new items will be added to the menu,
+        so we don't need to walk through a directory again."""
+
+        # The plugins might be installed before (when overwriting them)
+        self.plugins = [
+            plugin
+            for plugin in self.plugins
+            if plugin.get("file_path") not in file_paths
+        ]
+        for file_path in file_paths:
+            self.plugins.append(plugin_index.collect_plugin(file_path))
+
+        # The plugin might be placed in a new folder
+        self.categories = plugin_index.locate_categories(
+            self.plugins_directory, self.plugins
+        )
 
-        # If the plugin is a Nuke file, we use the nodePaste() function
-        elif file_path.endswith(".nk"):
-            magic_toolbar.addCommand(
-                menu_name,
-                "nuke.nodePaste('%s')" % file_path,
-                icon=icon_path,
-            )
+        self.__update_menu()
 
-    def __create_menus(self, toolbar, plugins):
+    def __create_menus(self, menu, categories):
         """Via this function we will build the folders in the menu.
         We could skip this function, but if we want icons,
         (of course we want icons!), we need to build the menu first."""
 
-        # Getting the directory to scan for plugins
-        plugins_directory = self.plugins_directory
-
         menu_name = self.menu_name
         menu_icon = os.path.join(
             self.script_directory, "resources", "icon.png"
@@ -296,61 +758,27 @@ class MagicPlugins(object):
         menu_icon = menu_icon.replace(os.sep, "/")
 
         # Creating the main menu item
-        toolbar.addMenu(menu_name, icon=menu_icon)
+        self.__add_menu(menu, menu_name, menu_icon)
 
-        # We are collecting the length for the directory, to only keep
-        # the category names.
-        # Like we have //network_drive/nuke_plugins/plugins/myplugins/folder/
-        # we keep /plugins/myplugins/folder/
-        plugins_directory_length = len(plugins_directory) + 1
+        # The categories only contain folders with plugins inside,
+        # this makes sure no empty folders are added.
+        for category_information in categories:
+            icon_path = category_information.get("icon_path")
 
-        plugin_file_paths = []
+            # Here we will build the category path to add in the menu
+            category = os.path.join(
+                menu_name, category_information.get("category")
+            )
+            category = category.replace(os.sep, "/")
 
-        # We build a little dictionary for the folders we need to scan
-        for plugin in plugins:
-            file_path = plugin.get("file_path")
-            plugin_file_paths.append(file_path)
-
-        # Walk through the dictionary to scan every folder, and
-        # if possible, add an icon.
-        for root, dirs, files in os.walk(plugins_directory):
-            for directory in sorted(dirs):
-                directory_path = os.path.join(root, directory)
-                directory_path = directory_path.replace(os.sep, "/")
-
-                # If the folder is added in the plugin_file_paths list, add
-                # the folder as a menu item. This makes sure no empty folders
-                # are added.
-                if any(directory_path in s for s in plugin_file_paths):
-                    directory_dirname = os.path.dirname(directory_path)
-                    directory_name = directory
-
-                    # We will build the possible icon path, and check if the
-                    # icon exists.
-                    directory_icon = directory_name + ".png"
-                    icon_path = os.path.join(directory_dirname, directory_icon)
-                    icon_path = icon_path.replace(os.sep, "/")
-
-                    # Here we will build the directory path to only contain the
-                    # path after the plugins folder, so we can save it as a
-                    # category path to add in the menu
-                    category = directory_path[plugins_directory_length:]
-
-                    category = os.path.join(menu_name, category)
-                    category = category.replace(os.sep, "/")
-
-                    # If the icon exists, add it, otherwise just
-                    # create a simple menu item
-                    if os.path.isfile(icon_path):
-                        toolbar.addMenu(category, icon=icon_path)
-
-                    else:
-                        toolbar.addMenu(category)
+            # If the icon exists, add it, otherwise just
+            # create a simple menu item
+            self.__add_menu(menu, category, icon_path)
 
         # Adding a divider line to distinguish commands and plugins
         divider_name = os.path.join(menu_name, "-")
         divider_name = divider_name.replace(os.sep, "/")
-        toolbar.addCommand(divider_name, "")
+        self.__add_command(menu, divider_name, "")
 
         # Add install plugin button
         install_plugin_name = os.path.join(menu_name, "Install plugin")
@@ -362,10 +790,11 @@ class MagicPlugins(object):
         )
         plugin_icon = plugin_icon.replace(os.sep, "/")
 
-        toolbar.addCommand(
+        self.__add_command(
+            menu,
             install_plugin_name,
             "magic_plugins.install_plugin()",
-            icon=plugin_icon,
+            plugin_icon,
         )
 
         # Add install plugin button
@@ -378,12 +807,42 @@ class MagicPlugins(object):
         )
         folder_icon = folder_icon.replace(os.sep, "/")
 
-        toolbar.addCommand(
+        self.__add_command(
+            menu,
             open_folder_name,
             "magic_plugins.open_folder()",
-            icon=folder_icon,
+            folder_icon,
         )
 
+        # Add rescan button, to pick up plugins added after startup
+        rescan_name = os.path.join(menu_name, "Rescan plugins")
+        rescan_name = rescan_name.replace(os.sep, "/")
+
+        self.__add_command(menu, rescan_name, "magic_plugins.rescan()")
+
+        # Add the repository button, when there is a repository
+        if self.repository_url:
+            repository_name = os.path.join(
+                menu_name, "Install from repository"
+            )
+            repository_name = repository_name.replace(os.sep, "/")
+
+            self.__add_command(
+                menu,
+                repository_name,
+                "magic_plugins.install_from_repository()",
+                plugin_icon,
+            )
+
+        # Add the profile summary button, when profiling
+        if self.load_profiler is not None:
+            profile_name = os.path.join(menu_name, "Plugin load profile")
+            profile_name = profile_name.replace(os.sep, "/")
+
+            self.__add_command(
+                menu, profile_name, "magic_plugins.show_load_profile()"
+            )
+
     def open_folder(self):
         """Via this function the user can
         easily open the folder where the plugins are located.
@@ -407,12 +866,12 @@ class MagicPlugins(object):
         else:
             nuke.critical("Couldn't find operating system")
 
-    def __populate_menu(self, magic_toolbar, plugins):
+    def __populate_menu(self, menu, plugins):
         """Via this function we will add all
         the available plugins in the menu
 
-        To use this function we need a specified
-        toolbar and a plugin dictionary.
+        To use this function we need the menu dictionary
+        and a plugin dictionary.
         """
 
         # Iterate trough the provided dictionary to add plugins
@@ -434,138 +893,224 @@ class MagicPlugins(object):
             # like we specified in the node_types variable,
             # build the createNode() function
             if any(s in plugin_type for s in node_types):
-                magic_toolbar.addCommand(
+                self.__add_command(
+                    menu,
                     menu_name,
-                    "nuke.createNode('%s')" % plugin_name,
-                    icon=icon_path,
+                    "magic_plugins.create_plugin('%s')" % plugin_name,
+                    icon_path,
                 )
 
             # If the plugin is a Nuke file, we use the nodePaste() function
             elif plugin_type == "nk":
-                magic_toolbar.addCommand(
+                self.__add_command(
+                    menu,
                     menu_name,
-                    "nuke.nodePaste('%s')" % file_path,
-                    icon=icon_path,
+                    "magic_plugins.paste_plugin('%s')" % file_path,
+                    icon_path,
                 )
 
-    def __locate_plugins(self, plugins_directory):
-        """This function will scan the specified folder for
-        plugins, and build a list containing all necessary information
-        to load the plugins"""
+    @staticmethod
+    def __add_menu(menu, menu_name, icon_path=None):
+        menu[menu_name] = {"type": "menu", "icon": icon_path}
 
-        # First we create an empty list where we will add al the plugins
-        # we want to process to load
-        plugins = []
+    @staticmethod
+    def __add_command(menu, menu_name, command, icon_path=None):
+        menu[menu_name] = {
+            "type": "command",
+            "command": command,
+            "icon": icon_path,
+        }
 
-        # Here we will determine the corresponding library extension
-        # to the current operating system
-        operating_system = self.operating_system
+    def __load_index(self):
+        """Load the plugins, categories and dependencies from the catalogue.
+        If the catalogue is missing or outdated, we will scan the plugins
+        directory instead. Dependencies will then be found when a plugin is
+        created, so we return None for those."""
 
-        if operating_system == "darwin":
-            library_extension = ".dylib"
+        if self.plugin_index.is_current():
+            self.__print("Loading plugins from catalogue")
+            plugins = self.plugin_index.load_plugins(
+                self.nuke_version, self.operating_system
+            )
+            categories = plugin_index.locate_categories(
+                self.plugins_directory,
+                plugins,
+                self.plugin_index.load_category_icons(),
+            )
+            dependencies = self.plugin_index.load_dependencies()
 
-        elif operating_system == "win32":
-            library_extension = ".dll"
+            # To find gizmos that changed after the catalogue was built
+            self.catalogue_file_stats = self.plugin_index.load_file_stats()
+
+            return plugins, categories, dependencies
+
+        if self.plugin_index.exists():
+            self.__print("Catalogue is outdated, scanning plugins directory")
+
+        self.catalogue_file_stats = {}
+
+        if self.scan_cache.max_age <= 0:
+            scan = self.__scan_plugins_directory()
 
         else:
-            library_extension = ".so"
-
-        # Now we will walk through the entire
-        # specified directory to scan for plugins
-        for root, dirs, files in os.walk(plugins_directory):
-            for filename in files:
-                # First we will build the path for the plugin we might
-                # want to append to the list
-                file_path = os.path.join(root, filename)
-                # Small fix which is necessary for Windows systems
-                file_path = file_path.replace(os.sep, "/")
-
-                # If the file is a gizmo or a nk file, we just go ahead and
-                # add it to our list
-                if file_path.endswith((".gizmo", ".nk")):
-                    # Add the plugin to the list to load
-                    plugin_information = self.__collect_plugin(file_path)
-                    plugins.append(plugin_information)
-
-                # If the file is a library file (.dll, .so or .dylib),
-                # we need to be a little bit more careful because
-                # every library file is build for a specific version of Nuke.
-                # So we don't want to add a library file thats build for
-                # Nuke 12.2 when we are in Nuke 13.2
-                elif file_path.endswith(library_extension):
-                    # Here we will validate if we want to load this plugin
-                    if self.__validate_plugin(file_path):
-                        # We want to load this plugin! Let's add it
-                        # to the list.
-                        plugin_information = self.__collect_plugin(file_path)
-                        plugins.append(plugin_information)
-
-        return plugins
-
-    def __validate_plugin(self, file_path):
-        """This function will check if the plugin
-        is ready to be loaded, or if we don't want to load it.
-
-        It will check if the .dll, .so or .dylib file upper folder
-        matches the current Nuke version.
-
-        If you want to add plugins to load, always make sure to create
-        a folder for the Nuke version where the plugins are compiled for.
-        Like if you want to use a plugin for version 13.1,
-        create a folder called '13.1' where you add the plugins inside."""
-
-        # We will firstly assume we won't validate the plugin, unless
-        # the plugin is indeed correct.
-        validated = False
-
-        # If the upper folder of the plugin matches the
-        # current Nuke version (e.g 13.2) we will let the validation pass.
-        dirname = os.path.dirname(file_path)
-        basename = os.path.basename(dirname)
-
-        if basename == str(self.nuke_version):
-            validated = True
-
-        return validated
-
-    def __collect_plugin(self, file_path):
-        """In this function we create a dictionary item for the plugin
-        provided the file path. At the end we will return
-        a dictionary item like this:
-
-        plugin_information = {
-            plugin_type: "gizmo",
-            file_path: "path/to/my/MagicTool.gizmo",
-            plugin_name: "MagicTool",
-            icon_path: "path/to/my/MagicTool.png"
-        }
+            scan = self.scan_cache.get(
+                "%s_%s" % (self.nuke_version, self.operating_system),
+                self.__scan_plugins_directory,
+            )
 
+        return scan.get("plugins"), scan.get("categories"), None
 
-        """
+    def __report_dependencies(self):
+        """Print the dependencies that are not available for this Nuke
+        version, and the plugins that depend on each other"""
 
-        # Get the file extension for the file, so we can
-        # check the plugin type
-        plugin_extension = os.path.splitext(file_path)[1]
-        plugin_type = plugin_extension.replace(".", "")
-
-        # Get the plugin name without the extension
-        plugin_name = os.path.basename(file_path)
-        plugin_name = os.path.splitext(plugin_name)[0]
-
-        # Build the dictionary with the required data
-        plugin_information = {
-            "plugin_type": plugin_type,
-            "file_path": file_path,
-            "plugin_name": plugin_name,
-            "icon_path": None,
-        }
+        # Only possible when we loaded the catalogue
+        if self.dependencies is None:
+            return
+
+        missing_dependencies = plugin_index.find_missing_dependencies(
+            self.dependencies, self.plugins
+        )
+        for plugin_name, missing in sorted(missing_dependencies.items()):
+            self.__print(
+                "%s uses %s, which is not available"
+                % (plugin_name, ", ".join(missing))
+            )
+
+        for cycle in plugin_index.find_dependency_cycles(self.dependencies):
+            self.__print("Cyclic dependency: %s" % " -> ".join(cycle))
+
+    def __get_dependencies(self, plugin_name, plugins_by_name):
+        """Return the dependencies of the plugin. Without catalogue we will
+        read the plugin (and the plugins it uses) to find them. With a
+        catalogue we only read the gizmos and scripts that have been
+        changed since the catalogue was built."""
+
+        found_dependencies = self.found_dependencies
+
+        # Only plugins we can create as a node can be used inside others
+        node_names = set(
+            name
+            for name, plugin in plugins_by_name.items()
+            if plugin.get("plugin_type") in plugin_index.NODE_TYPES
+        )
+
+        unchecked_names = [plugin_name]
+        while unchecked_names:
+            name = unchecked_names.pop()
+            if name in found_dependencies or name not in plugins_by_name:
+                continue
+
+            plugin = plugins_by_name.get(name)
+            if self.dependencies is not None and not self.__is_changed(
+                plugin
+            ):
+                found_dependencies[name] = self.dependencies.get(name, [])
+
+            else:
+                dependencies = plugin_index.locate_dependencies(
+                    [plugin], node_names
+                )
+                found_dependencies[name] = dependencies.get(name, [])
+
+            unchecked_names.extend(found_dependencies.get(name))
+
+        return found_dependencies
+
+    def __is_changed(self, plugin):
+        """Check if a gizmo or script has been changed since the
+        catalogue was built. Libraries don't have dependencies."""
+
+        file_path = plugin.get("file_path")
+        if not file_path.endswith(plugin_index.BASIC_EXTENSIONS):
+            return False
+
+        file_stats = self.catalogue_file_stats.get(file_path)
+        if file_stats is None:
+            return True
+
+        try:
+            file_stat = os.stat(file_path)
+
+        # Nuke will show the error when creating the node
+        except OSError:
+            return False
+
+        return (file_stat.st_size, file_stat.st_mtime) != tuple(file_stats)
+
+    def __prefetch_dependencies(self, plugin_name):
+        """Read the files of the plugin and all plugins it uses inside at
+        the same time, instead of Nuke reading them one after another.
+        Libraries are loaded up front, so Nuke doesn't need to search the
+        plugin path for them."""
+
+        plugins_by_name = dict(
+            (plugin.get("plugin_name"), plugin) for plugin in self.plugins
+        )
+
+        dependencies = self.__get_dependencies(plugin_name, plugins_by_name)
+        closure = plugin_index.get_dependency_closure(
+            plugin_name, dependencies
+        )
+
+        # Missing dependencies are already reported when loading plugins
+        prefetch_plugins = [
+            plugins_by_name.get(name)
+            for name in closure + [plugin_name]
+            if name in plugins_by_name and name not in self.prefetched_plugins
+        ]
+
+        if not prefetch_plugins:
+            return
+
+        # Reading the files puts them in the file system cache. A few
+        # threads are enough to have the reads overlap, and we never keep
+        # the artist waiting longer than the timeout.
+        prefetch = read_ahead.ReadAhead(
+            [plugin.get("file_path") for plugin in prefetch_plugins],
+            byte_budget=float("inf"),
+            thread_count=min(
+                self.prefetch_thread_count, len(prefetch_plugins)
+            ),
+        )
+        prefetch.start()
+        prefetch.wait(self.prefetch_timeout)
+
+        # Whatever is not read yet, Nuke will read itself
+        prefetch.cancel()
 
-        # If there is an icon available, lets add it to the dictionary.
-        icon_path = file_path.replace(plugin_extension, ".png")
-        if os.path.isfile(icon_path):
-            plugin_information["icon_path"] = icon_path
+        # Dependencies come first, so libraries are loaded before
+        # the plugins using them
+        for plugin in prefetch_plugins:
+            if plugin.get("plugin_type") in plugin_index.LIBRARY_TYPES:
+                try:
+                    nuke.load(plugin.get("file_path"))
 
-        return plugin_information
+                # Nuke will show the error when creating the node
+                except RuntimeError as error:
+                    self.__print(str(error))
+
+            self.prefetched_plugins.add(plugin.get("plugin_name"))
+
+    def __scan_plugins_directory(self):
+        """Scan the plugins directory for plugins and categories,
+        the result is shared with other sessions via the scan cache"""
+
+        plugins = self.__locate_plugins(self.plugins_directory)
+        categories = plugin_index.locate_categories(
+            self.plugins_directory, plugins
+        )
+
+        return {"plugins": plugins, "categories": categories}
+
+    def __locate_plugins(self, plugins_directory):
+        """This function will scan the specified folder for
+        plugins, and build a list containing all necessary information
+        to load the plugins"""
+
+        return plugin_index.locate_plugins(
+            plugins_directory, self.nuke_version, self.operating_system
+        )
 
     def __get_plugin_category(self, file_path):
         """This function will detect the plugin dictionary
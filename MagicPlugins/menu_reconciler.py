@@ -0,0 +1,212 @@
+"""
+MagicPlugins by Gilles Vink
+
+Apply only the changes to the Nuke menu
+
+Instead of adding every menu and command again each time the menu is
+refreshed, we keep a record of what we added last time. The new menu is
+compared with that record, so only new or changed items are added and
+only items that are gone are removed.
+
+"""
+
+from collections import OrderedDict
+
+
+class MenuReconciler(object):
+    """Keeps track of the items added to a toolbar, and applies the
+    difference between those and the desired menu.
+
+    The desired menu is an ordered dictionary with the full menu path
+    as key, and a dictionary describing the item as value:
+
+    desired_menu = {
+        "MagicPlugins/Internet": {"type": "menu", "icon": "Internet.png"},
+        "MagicPlugins/Internet/MagicTool": {
+            "type": "command",
+            "command": "nuke.createNode('MagicTool')",
+            "icon": "MagicTool.png",
+        },
+    }
+
+    Parent menus need to come before their items."""
+
+    def __init__(self):
+        # Everything we added to the toolbar last time
+        self.applied_menu = OrderedDict()
+
+    def apply(self, toolbar, desired_menu):
+        """Update the toolbar to match the desired menu.
+        Returns the amount of added and removed items."""
+
+        applied_menu = self.applied_menu
+
+        # Items that are gone, or have been changed, need to be removed
+        removed_paths = [
+            path
+            for path, item in applied_menu.items()
+            if desired_menu.get(path) != item
+        ]
+
+        # When a menu is removed all its items are removed as well, so
+        # we only need to remove the top most paths
+        removed_paths = [
+            path
+            for path in removed_paths
+            if not any(
+                path.startswith(parent + "/") for parent in removed_paths
+            )
+        ]
+
+        for path in removed_paths:
+            self.__remove_item(toolbar, path)
+
+            # Forget about the item and everything inside of it
+            for applied_path in list(applied_menu):
+                if applied_path == path or applied_path.startswith(
+                    path + "/"
+                ):
+                    del applied_menu[applied_path]
+
+        added_count = 0
+
+        for path, item in desired_menu.items():
+            if applied_menu.get(path) == item:
+                continue
+
+            if item.get("type") == "menu":
+                toolbar.addMenu(path, icon=item.get("icon"))
+
+            else:
+                toolbar.addCommand(
+                    path, item.get("command"), icon=item.get("icon")
+                )
+
+            applied_menu[path] = item
+            added_count += 1
+
+        return added_count, len(removed_paths)
+
+    @staticmethod
+    def __remove_item(toolbar, path):
+        """Items can only be removed from the menu they are in, so we
+        need to find the parent menu first"""
+
+        if "/" in path:
+            parent_path, name = path.rsplit("/", 1)
+            parent_menu = toolbar.findItem(parent_path)
+
+        else:
+            parent_menu, name = toolbar, path
+
+        if parent_menu is not None:
+            parent_menu.removeItem(name)
+
+
+def split_menu(desired_menu, max_items, excluded_paths=()):
+    """Split menus with more commands than the maximum into alphabetical
+    pages, like "MagicPlugins/Color/A-F" and "MagicPlugins/Color/G-M".
+    Sub menus stay where they are, and excluded menus are never split.
+
+    Returns a new desired menu."""
+
+    # Collect the commands inside every menu
+    menu_commands = OrderedDict()
+    for path, item in desired_menu.items():
+        if item.get("type") == "command" and "/" in path:
+            parent_path = path.rsplit("/", 1)[0]
+            menu_commands.setdefault(parent_path, []).append(path)
+
+    # Find the new path for the commands in every menu that is too big
+    paged_paths = {}
+    page_menus = {}
+
+    for parent_path, command_paths in menu_commands.items():
+        if len(command_paths) <= max_items or parent_path in excluded_paths:
+            continue
+
+        names = sorted(
+            (path.rsplit("/", 1)[1] for path in command_paths),
+            key=lambda name: name.lower(),
+        )
+        pages = [
+            names[start : start + max_items]
+            for start in range(0, len(names), max_items)
+        ]
+
+        page_paths = []
+        for page_number, page in enumerate(pages):
+            previous_name = None
+            if page_number > 0:
+                previous_name = pages[page_number - 1][-1]
+
+            next_name = None
+            if page_number < len(pages) - 1:
+                next_name = pages[page_number + 1][0]
+
+            label = _get_page_label(
+                page[0], page[-1], previous_name, next_name
+            )
+            page_path = "%s/%s" % (parent_path, label)
+            page_paths.append(page_path)
+
+            for name in page:
+                paged_paths["%s/%s" % (parent_path, name)] = page_path
+
+        page_menus[command_paths[0]] = (
+            page_paths,
+            ["%s/%s" % (parent_path, name) for name in names],
+        )
+
+    if not paged_paths:
+        return desired_menu
+
+    split_desired_menu = OrderedDict()
+
+    for path, item in desired_menu.items():
+        if path not in paged_paths:
+            split_desired_menu[path] = item
+            continue
+
+        # The pages and all their commands are added in alphabetical
+        # order, where the first command of the menu used to be
+        if path in page_menus:
+            page_paths, command_paths = page_menus.get(path)
+
+            for page_path in page_paths:
+                split_desired_menu[page_path] = {"type": "menu", "icon": None}
+
+            for command_path in command_paths:
+                name = command_path.rsplit("/", 1)[1]
+                paged_path = "%s/%s" % (paged_paths.get(command_path), name)
+                split_desired_menu[paged_path] = desired_menu.get(command_path)
+
+    return split_desired_menu
+
+
+def _get_page_label(first_name, last_name, previous_name, next_name):
+    """Build a label like "A-F" for a page. When a page starts or ends
+    with the same letter as its neighbour, more letters are used to tell
+    them apart, like "Ba-Bl"."""
+
+    def get_prefix(name, neighbour_name):
+        length = 1
+        if neighbour_name is not None:
+            name_lower = name.lower()
+            neighbour_lower = neighbour_name.lower()
+            while (
+                length < len(name_lower)
+                and name_lower[:length] == neighbour_lower[:length]
+            ):
+                length += 1
+
+        prefix = name[:length]
+        return prefix[:1].upper() + prefix[1:]
+
+    start = get_prefix(first_name, previous_name)
+    end = get_prefix(last_name, next_name)
+
+    if start == end:
+        return start
+
+    return "%s-%s" % (start, end)
@@ -0,0 +1,785 @@
+"""
+MagicPlugins by Gilles Vink
+
+Plugin discovery and the offline plugin catalogue
+
+This module doesn't need Nuke, so the expensive scan of the plugins
+directory can be done once by a pipeline and written to a SQLite
+catalogue. Every Nuke session will then load its plugins with a single
+query instead of walking the entire (network) directory.
+
+Build the catalogue from the command line:
+
+    python plugin_index.py
+    python plugin_index.py --plugins-directory //server/MagicPlugins/plugins
+
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import time
+
+
+# The name of the catalogue file, which is placed next to the plugins folder
+CATALOGUE_NAME = "magic_plugins_index.db"
+
+# Bump this whenever the layout of the catalogue changes, so old
+# catalogues will be ignored instead of giving wrong results
+CATALOGUE_SCHEMA_VERSION = 2
+
+# Extensions we can load directly, regardless of the Nuke version
+BASIC_EXTENSIONS = (".gizmo", ".nk")
+
+# These are the plugins we would call library
+LIBRARY_EXTENSIONS = (".dll", ".so", ".dylib")
+
+# The plugin types of libraries, which is the extension without the dot
+LIBRARY_TYPES = tuple(extension[1:] for extension in LIBRARY_EXTENSIONS)
+
+# Plugins that can be created as a node, so other plugins can use them
+NODE_TYPES = ("gizmo",) + LIBRARY_TYPES
+
+# In .gizmo and .nk files every node starts with a line like "Blur {"
+NODE_CLASS_PATTERN = re.compile(r"^[ \t]*([A-Za-z_][\w.]*)[ \t]*\{", re.M)
+
+
+def get_library_extension(operating_system):
+    """Return the library extension that matches the operating system,
+    like sys.platform returns it."""
+
+    if operating_system == "darwin":
+        return ".dylib"
+
+    elif operating_system == "win32":
+        return ".dll"
+
+    return ".so"
+
+
+def replace_file(source_path, destination_path):
+    """Rename the file, replacing the destination if it exists. Used to
+    move fully written temporary files into place."""
+
+    # os.rename won't overwrite existing files on Windows
+    if hasattr(os, "replace"):
+        os.replace(source_path, destination_path)
+
+    else:
+        if os.path.isfile(destination_path):
+            os.remove(destination_path)
+        os.rename(source_path, destination_path)
+
+
+def get_directory_mtimes(plugins_directory):
+    """Return the modification time of every folder in the plugins
+    directory, relative to the plugins directory. Adding or removing a file
+    or a folder changes the modification time of its folder, so this is a
+    fingerprint of the plugins we would find."""
+
+    plugins_directory_length = len(plugins_directory) + 1
+
+    directory_mtimes = {}
+    for root, dirs, files in os.walk(plugins_directory):
+        root = root.replace(os.sep, "/")
+        directory_mtimes[root[plugins_directory_length:]] = os.stat(
+            root
+        ).st_mtime
+
+    return directory_mtimes
+
+
+def directories_match(plugins_directory, directory_mtimes):
+    """Check if the folders still have the modification times from
+    get_directory_mtimes, without walking the entire directory"""
+
+    for directory_path, mtime in directory_mtimes.items():
+        absolute_path = plugins_directory
+        if directory_path:
+            absolute_path = "%s/%s" % (plugins_directory, directory_path)
+
+        try:
+            if os.stat(absolute_path).st_mtime != mtime:
+                return False
+
+        # The folder has been removed
+        except OSError:
+            return False
+
+    return True
+
+
+def get_default_plugins_directory():
+    """Return the plugins directory that is shipped next to this script"""
+
+    script_directory = os.path.dirname(os.path.realpath(__file__))
+    plugins_directory = os.path.join(script_directory, "plugins")
+
+    # Fix for Windows based systems
+    return plugins_directory.replace(os.sep, "/")
+
+
+def get_default_catalogue_path(plugins_directory):
+    """The catalogue is always stored next to the plugins directory"""
+
+    catalogue_path = os.path.join(
+        os.path.dirname(plugins_directory), CATALOGUE_NAME
+    )
+    return catalogue_path.replace(os.sep, "/")
+
+
+def validate_plugin(file_path, nuke_version):
+    """This function will check if the plugin
+    is ready to be loaded, or if we don't want to load it.
+
+    It will check if the .dll, .so or .dylib file upper folder
+    matches the current Nuke version.
+
+    If you want to add plugins to load, always make sure to create
+    a folder for the Nuke version where the plugins are compiled for.
+    Like if you want to use a plugin for version 13.1,
+    create a folder called '13.1' where you add the plugins inside."""
+
+    # If the upper folder of the plugin matches the
+    # current Nuke version (e.g 13.2) we will let the validation pass.
+    dirname = os.path.dirname(file_path)
+    basename = os.path.basename(dirname)
+
+    return basename == str(nuke_version)
+
+
+def collect_plugin(file_path, locate_icon=True):
+    """In this function we create a dictionary item for the plugin
+    provided the file path. At the end we will return
+    a dictionary item like this:
+
+    plugin_information = {
+        plugin_type: "gizmo",
+        file_path: "path/to/my/MagicTool.gizmo",
+        plugin_name: "MagicTool",
+        icon_path: "path/to/my/MagicTool.png"
+    }
+
+    When loading from the catalogue the icon is already known, so
+    locate_icon can be disabled to skip checking the disk.
+    """
+
+    # Get the file extension for the file, so we can
+    # check the plugin type
+    plugin_extension = os.path.splitext(file_path)[1]
+    plugin_type = plugin_extension.replace(".", "")
+
+    # Get the plugin name without the extension
+    plugin_name = os.path.basename(file_path)
+    plugin_name = os.path.splitext(plugin_name)[0]
+
+    # Build the dictionary with the required data
+    plugin_information = {
+        "plugin_type": plugin_type,
+        "file_path": file_path,
+        "plugin_name": plugin_name,
+        "icon_path": None,
+    }
+
+    # If there is an icon available, lets add it to the dictionary.
+    if locate_icon:
+        icon_path = file_path.replace(plugin_extension, ".png")
+        if os.path.isfile(icon_path):
+            plugin_information["icon_path"] = icon_path
+
+    return plugin_information
+
+
+def locate_plugins(plugins_directory, nuke_version, operating_system):
+    """This function will scan the specified folder for
+    plugins, and build a list containing all necessary information
+    to load the plugins"""
+
+    # First we create an empty list where we will add al the plugins
+    # we want to process to load
+    plugins = []
+
+    # Here we will determine the corresponding library extension
+    # to the current operating system
+    library_extension = get_library_extension(operating_system)
+
+    # Now we will walk through the entire
+    # specified directory to scan for plugins
+    for root, dirs, files in os.walk(plugins_directory):
+        for filename in files:
+            # First we will build the path for the plugin we might
+            # want to append to the list
+            file_path = os.path.join(root, filename)
+            # Small fix which is necessary for Windows systems
+            file_path = file_path.replace(os.sep, "/")
+
+            # If the file is a gizmo or a nk file, we just go ahead and
+            # add it to our list
+            if file_path.endswith(BASIC_EXTENSIONS):
+                # Add the plugin to the list to load
+                plugins.append(collect_plugin(file_path))
+
+            # If the file is a library file (.dll, .so or .dylib),
+            # we need to be a little bit more careful because
+            # every library file is build for a specific version of Nuke.
+            # So we don't want to add a library file thats build for
+            # Nuke 12.2 when we are in Nuke 13.2
+            elif file_path.endswith(library_extension):
+                # Here we will validate if we want to load this plugin
+                if validate_plugin(file_path, nuke_version):
+                    # We want to load this plugin! Let's add it
+                    # to the list.
+                    plugins.append(collect_plugin(file_path))
+
+    return plugins
+
+
+def locate_categories(plugins_directory, plugins, category_icons=None):
+    """Build the list of categories (folders) that contain plugins,
+    so no empty folders will end up in the menu. Parent folders
+    always come before their sub folders.
+
+    Every category is a dictionary like this:
+
+    category_information = {
+        category: "Internet/Color",
+        icon_path: "path/to/plugins/Internet/Color.png"
+    }
+
+    If a mapping of category icons is provided (like the one stored in
+    the catalogue), we won't check the disk for icons."""
+
+    # We are collecting the length for the directory, to only keep
+    # the category names.
+    plugins_directory_length = len(plugins_directory) + 1
+
+    categories = set()
+
+    # Every folder between the plugins directory and the plugin
+    # is a category we need to add
+    for plugin in plugins:
+        directory_path = os.path.dirname(plugin.get("file_path"))
+
+        while len(directory_path) >= plugins_directory_length:
+            categories.add(directory_path[plugins_directory_length:])
+            directory_path = os.path.dirname(directory_path)
+
+    category_list = []
+
+    for category in sorted(categories, key=lambda c: c.split("/")):
+        if category_icons is not None:
+            icon_path = category_icons.get(category)
+
+        else:
+            # The icon lives next to the folder, with the same name
+            icon_path = "%s/%s.png" % (plugins_directory, category)
+            if not os.path.isfile(icon_path):
+                icon_path = None
+
+        category_list.append({"category": category, "icon_path": icon_path})
+
+    return category_list
+
+
+def find_node_classes(file_path):
+    """Return all node classes used inside a .gizmo or .nk file"""
+
+    try:
+        with open(file_path, "r") as nuke_file:
+            return set(NODE_CLASS_PATTERN.findall(nuke_file.read()))
+
+    # A file we can't read, can't tell us anything
+    except (IOError, OSError, UnicodeDecodeError):
+        return set()
+
+
+def locate_dependencies(plugins, node_names=None):
+    """Find the plugins every .gizmo and .nk plugin uses inside.
+    Returns a dictionary like this:
+
+    dependencies = {
+        "MagicTool": ["MagicBlur", "MagicLibrary"]
+    }
+
+    By default only the provided plugins can be a dependency, but a set of
+    all the plugin names we know can be provided as node names as well."""
+
+    if node_names is None:
+        node_names = set(
+            plugin.get("plugin_name")
+            for plugin in plugins
+            if plugin.get("plugin_type") in NODE_TYPES
+        )
+
+    dependencies = {}
+
+    for plugin in plugins:
+        if plugin.get("plugin_type") not in ("gizmo", "nk"):
+            continue
+
+        plugin_name = plugin.get("plugin_name")
+        node_classes = find_node_classes(plugin.get("file_path"))
+
+        # We only care about the nodes that are plugins themselves
+        plugin_dependencies = (node_classes & node_names) - set([plugin_name])
+        if plugin_dependencies:
+            dependencies[plugin_name] = sorted(plugin_dependencies)
+
+    return dependencies
+
+
+def get_dependency_closure(plugin_name, dependencies):
+    """Return every plugin the plugin depends on, also the plugins those
+    depend on. Dependencies always come before the plugins using them."""
+
+    closure = []
+    visited = set([plugin_name])
+
+    def visit(name):
+        for dependency_name in dependencies.get(name, ()):
+            # This also prevents us from looping forever on cycles
+            if dependency_name in visited:
+                continue
+
+            visited.add(dependency_name)
+            visit(dependency_name)
+            closure.append(dependency_name)
+
+    visit(plugin_name)
+
+    return closure
+
+
+def find_missing_dependencies(dependencies, plugins):
+    """Return the dependencies of the provided plugins that aren't
+    available, like libraries not compiled for this Nuke version.
+
+    missing_dependencies = {
+        "MagicTool": ["MagicLibrary"]
+    }"""
+
+    plugin_names = set(plugin.get("plugin_name") for plugin in plugins)
+
+    missing_dependencies = {}
+
+    for plugin_name in sorted(plugin_names):
+        missing = [
+            dependency_name
+            for dependency_name in dependencies.get(plugin_name, ())
+            if dependency_name not in plugin_names
+        ]
+        if missing:
+            missing_dependencies[plugin_name] = missing
+
+    return missing_dependencies
+
+
+def find_dependency_cycles(dependencies):
+    """Return every cycle in the dependencies, like
+    ["MagicTool", "MagicBlur", "MagicTool"] when both use each other."""
+
+    cycles = []
+    finished = set()
+    path = []
+
+    def visit(name):
+        if name in path:
+            cycles.append(path[path.index(name) :] + [name])
+            return
+
+        if name in finished:
+            return
+
+        path.append(name)
+        for dependency_name in dependencies.get(name, ()):
+            visit(dependency_name)
+        path.pop()
+
+        finished.add(name)
+
+    for plugin_name in sorted(dependencies):
+        visit(plugin_name)
+
+    return cycles
+
+
+class PluginIndex(object):
+    """The SQLite catalogue of everything inside the plugins directory.
+
+    The catalogue contains the plugins for every Nuke version and every
+    operating system, the categories with their icons and fingerprints of
+    all files and folders. Paths are stored relative to the plugins
+    directory, so the same catalogue works from every mount point."""
+
+    def __init__(self, plugins_directory, catalogue_path=None):
+        self.plugins_directory = plugins_directory.replace(os.sep, "/")
+
+        if catalogue_path is None:
+            catalogue_path = get_default_catalogue_path(self.plugins_directory)
+
+        self.catalogue_path = catalogue_path.replace(os.sep, "/")
+
+    def exists(self):
+        return os.path.isfile(self.catalogue_path)
+
+    def build(self):
+        """Scan the entire plugins directory and write the catalogue.
+        The catalogue is written to a temporary file first and then
+        renamed, so readers will never see a half written catalogue.
+
+        Returns the number of plugins added to the catalogue."""
+
+        temporary_path = "%s.%i.tmp" % (self.catalogue_path, os.getpid())
+        if os.path.isfile(temporary_path):
+            os.remove(temporary_path)
+
+        connection = sqlite3.connect(temporary_path)
+        try:
+            self.__create_tables(connection)
+            plugin_count = self.__scan(connection)
+            connection.commit()
+
+        finally:
+            connection.close()
+
+        replace_file(temporary_path, self.catalogue_path)
+
+        return plugin_count
+
+    def is_current(self):
+        """Check if the catalogue exists and still matches the plugins
+        directory. Adding or removing a file or a folder changes the
+        modification time of the folder, so we only need to check those
+        instead of walking the entire directory.
+
+        Changing a file doesn't change its folder. Checking every file
+        would cost as much as scanning, so changed gizmos and scripts are
+        checked when they are created (see load_file_stats)."""
+
+        if not self.exists():
+            return False
+
+        try:
+            connection = sqlite3.connect(self.catalogue_path)
+            try:
+                metadata = dict(
+                    connection.execute("SELECT key, value FROM metadata")
+                )
+                if metadata.get("schema_version") != str(
+                    CATALOGUE_SCHEMA_VERSION
+                ):
+                    return False
+
+                directories = connection.execute(
+                    "SELECT directory_path, mtime FROM directories"
+                ).fetchall()
+
+            finally:
+                connection.close()
+
+        except sqlite3.DatabaseError:
+            return False
+
+        return directories_match(self.plugins_directory, dict(directories))
+
+    def load_plugins(self, nuke_version, operating_system):
+        """Load the plugins for the Nuke version and operating system
+        with a single query. Gives the same result as locate_plugins."""
+
+        library_extension = get_library_extension(operating_system)
+
+        connection = sqlite3.connect(self.catalogue_path)
+        try:
+            rows = connection.execute(
+                "SELECT file_path, icon_path FROM plugins "
+                "WHERE nuke_version IS NULL "
+                "OR (library_extension = ? AND nuke_version = ?) "
+                "ORDER BY id",
+                (library_extension, str(nuke_version)),
+            ).fetchall()
+
+        finally:
+            connection.close()
+
+        plugins = []
+        for file_path, icon_path in rows:
+            plugin_information = collect_plugin(
+                self.__absolute_path(file_path), locate_icon=False
+            )
+            if icon_path is not None:
+                plugin_information["icon_path"] = self.__absolute_path(
+                    icon_path
+                )
+
+            plugins.append(plugin_information)
+
+        return plugins
+
+    def load_category_icons(self):
+        """Return a dictionary with the icon for every category"""
+
+        connection = sqlite3.connect(self.catalogue_path)
+        try:
+            rows = connection.execute(
+                "SELECT category, icon_path FROM categories"
+            ).fetchall()
+
+        finally:
+            connection.close()
+
+        category_icons = {}
+        for category, icon_path in rows:
+            if icon_path is not None:
+                icon_path = self.__absolute_path(icon_path)
+            category_icons[category] = icon_path
+
+        return category_icons
+
+    def load_dependencies(self):
+        """Return the dependencies for every plugin, just like
+        locate_dependencies does"""
+
+        connection = sqlite3.connect(self.catalogue_path)
+        try:
+            rows = connection.execute(
+                "SELECT plugin_name, dependency_name FROM dependencies "
+                "ORDER BY plugin_name, dependency_name"
+            ).fetchall()
+
+        finally:
+            connection.close()
+
+        dependencies = {}
+        for plugin_name, dependency_name in rows:
+            dependencies.setdefault(plugin_name, []).append(dependency_name)
+
+        return dependencies
+
+    def load_file_stats(self):
+        """Return the size and modification time of every gizmo and
+        script when the catalogue was built, by their full path. Their
+        contents decide the dependencies, so this tells us when those
+        need to be read again."""
+
+        basic_types = [
+            extension.replace(".", "") for extension in BASIC_EXTENSIONS
+        ]
+
+        connection = sqlite3.connect(self.catalogue_path)
+        try:
+            rows = connection.execute(
+                "SELECT file_path, size, mtime FROM plugins "
+                "WHERE plugin_type IN (%s)"
+                % ", ".join("?" for _ in basic_types),
+                basic_types,
+            ).fetchall()
+
+        finally:
+            connection.close()
+
+        return dict(
+            (self.__absolute_path(file_path), (size, mtime))
+            for file_path, size, mtime in rows
+        )
+
+    def __absolute_path(self, relative_path):
+        if relative_path == "":
+            return self.plugins_directory
+
+        return "%s/%s" % (self.plugins_directory, relative_path)
+
+    @staticmethod
+    def __create_tables(connection):
+        connection.executescript(
+            """
+            CREATE TABLE metadata (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE plugins (
+                id INTEGER PRIMARY KEY,
+                plugin_name TEXT NOT NULL,
+                plugin_type TEXT NOT NULL,
+                file_path TEXT NOT NULL UNIQUE,
+                icon_path TEXT,
+                category TEXT NOT NULL,
+                nuke_version TEXT,
+                library_extension TEXT,
+                size INTEGER,
+                mtime REAL
+            );
+            CREATE INDEX plugins_version
+                ON plugins (nuke_version, library_extension);
+            CREATE TABLE categories (
+                category TEXT PRIMARY KEY,
+                icon_path TEXT
+            );
+            CREATE TABLE directories (
+                directory_path TEXT PRIMARY KEY,
+                mtime REAL
+            );
+            CREATE TABLE dependencies (
+                plugin_name TEXT NOT NULL,
+                dependency_name TEXT NOT NULL
+            );
+            """
+        )
+
+    def __scan(self, connection):
+        """Walk through the plugins directory and add every plugin,
+        category and folder to the catalogue"""
+
+        plugins_directory = self.plugins_directory
+        plugins_directory_length = len(plugins_directory) + 1
+
+        plugin_count = 0
+
+        # We need all plugins to find the dependencies afterwards
+        plugins = []
+
+        for root, dirs, files in os.walk(plugins_directory):
+            root = root.replace(os.sep, "/")
+            relative_root = root[plugins_directory_length:]
+
+            # Fingerprint for the folder, to detect added or removed files
+            connection.execute(
+                "INSERT INTO directories VALUES (?, ?)",
+                (relative_root, os.stat(root).st_mtime),
+            )
+
+            # Every folder is a possible category, with an optional icon
+            # next to it
+            for directory in dirs:
+                category = "/".join(
+                    part for part in (relative_root, directory) if part
+                )
+                icon_path = None
+                if "%s.png" % directory in files:
+                    icon_path = "%s.png" % category
+
+                connection.execute(
+                    "INSERT INTO categories VALUES (?, ?)",
+                    (category, icon_path),
+                )
+
+            for filename in sorted(files):
+                name, extension = os.path.splitext(filename)
+
+                if extension in BASIC_EXTENSIONS:
+                    nuke_version = None
+                    library_extension = None
+
+                # Libraries are only loaded for the Nuke version they are
+                # placed in, so we store the version folder as well
+                elif extension in LIBRARY_EXTENSIONS:
+                    nuke_version = os.path.basename(root)
+                    library_extension = extension
+
+                else:
+                    continue
+
+                relative_path = "/".join(
+                    part for part in (relative_root, filename) if part
+                )
+                icon_path = None
+                if "%s.png" % name in files:
+                    icon_path = relative_path.replace(extension, ".png")
+
+                file_stat = os.stat(os.path.join(root, filename))
+                plugins.append(
+                    collect_plugin(
+                        "%s/%s" % (root, filename), locate_icon=False
+                    )
+                )
+
+                connection.execute(
+                    "INSERT INTO plugins (plugin_name, plugin_type, "
+                    "file_path, icon_path, category, nuke_version, "
+                    "library_extension, size, mtime) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        name,
+                        extension.replace(".", ""),
+                        relative_path,
+                        icon_path,
+                        relative_root,
+                        nuke_version,
+                        library_extension,
+                        file_stat.st_size,
+                        file_stat.st_mtime,
+                    ),
+                )
+                plugin_count += 1
+
+        # Libraries for every Nuke version can be a dependency, so those
+        # are all collected here
+        dependencies = locate_dependencies(
+            plugins,
+            set(
+                plugin.get("plugin_name")
+                for plugin in plugins
+                if plugin.get("plugin_type") in NODE_TYPES
+            ),
+        )
+        connection.executemany(
+            "INSERT INTO dependencies VALUES (?, ?)",
+            (
+                (plugin_name, dependency_name)
+                for plugin_name in sorted(dependencies)
+                for dependency_name in dependencies.get(plugin_name)
+            ),
+        )
+
+        connection.executemany(
+            "INSERT INTO metadata VALUES (?, ?)",
+            (
+                ("schema_version", str(CATALOGUE_SCHEMA_VERSION)),
+                ("plugins_directory", plugins_directory),
+                ("build_time", str(time.time())),
+            ),
+        )
+
+        return plugin_count
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description="Build the MagicPlugins catalogue, so Nuke doesn't "
+        "need to scan the plugins directory at startup."
+    )
+    parser.add_argument(
+        "--plugins-directory",
+        default=get_default_plugins_directory(),
+        help="The plugins directory to scan (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Where to write the catalogue (default: next to the "
+        "plugins directory)",
+    )
+    arguments = parser.parse_args(arguments)
+
+    plugins_directory = os.path.realpath(arguments.plugins_directory)
+    if not os.path.isdir(plugins_directory):
+        parser.error("Plugins directory %s not found" % plugins_directory)
+
+    index = PluginIndex(plugins_directory, arguments.output)
+    plugin_count = index.build()
+
+    print(
+        "[MagicPlugins] Added %i plugins to %s"
+        % (plugin_count, index.catalogue_path)
+    )
+
+    # Let the pipeline know about plugins that can never be created
+    for cycle in find_dependency_cycles(index.load_dependencies()):
+        print("[MagicPlugins] Cyclic dependency: %s" % " -> ".join(cycle))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
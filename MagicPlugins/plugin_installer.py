@@ -0,0 +1,158 @@
+"""
+MagicPlugins by Gilles Vink
+
+Background installer to copy plugins into the plugins directory
+
+Copying a big library from a slow network share could freeze Nuke,
+so the installer copies in chunks on a background thread. All files are
+copied to a temporary name first and verified with a checksum. Only when
+every file is verified, they are renamed into place. This way a failed
+copy will never leave a partial plugin (or just its icon) behind that
+would be loaded at the next startup.
+
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+
+import plugin_index
+
+
+class InstallCancelled(Exception):
+    pass
+
+
+class PluginInstaller(threading.Thread):
+    """Copy a list of files on a background thread.
+
+    The progress callback is called with the amount of copied bytes
+    and the total amount of bytes. The finished callback is called with
+    None when everything is installed, or with the error. Both callbacks
+    are called from the background thread."""
+
+    def __init__(
+        self,
+        files,
+        progress_callback=None,
+        finished_callback=None,
+        chunk_size=1024 * 1024,
+    ):
+        """files is a list of (source path, install path) tuples"""
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.files = files
+        self.progress_callback = progress_callback
+        self.finished_callback = finished_callback
+        self.chunk_size = chunk_size
+
+        self.copied_bytes = 0
+        self.total_bytes = 0
+
+        self.__cancelled = threading.Event()
+
+    def cancel(self):
+        self.__cancelled.set()
+
+    def run(self):
+        error = None
+        staged_files = []
+
+        try:
+            self.total_bytes = sum(
+                os.path.getsize(source_path) for source_path, _ in self.files
+            )
+
+            for source_path, install_path in self.files:
+                temporary_path = self.__get_temporary_path(install_path)
+                staged_files.append((temporary_path, install_path))
+                self.__stage_file(source_path, temporary_path)
+
+            # Everything is copied and verified, now we can install
+            for temporary_path, install_path in staged_files:
+                plugin_index.replace_file(temporary_path, install_path)
+
+        # Every error is reported to the finished callback, so the
+        # artist can see it
+        except Exception as install_error:
+            error = install_error
+
+        finally:
+            for temporary_path, _ in staged_files:
+                if os.path.isfile(temporary_path):
+                    os.remove(temporary_path)
+
+        if self.finished_callback is not None:
+            self.finished_callback(error)
+
+    @staticmethod
+    def __get_temporary_path(install_path):
+        """The temporary file doesn't end with a plugin extension and
+        is hidden, so it will never be picked up as a plugin"""
+
+        return os.path.join(
+            os.path.dirname(install_path),
+            ".%s.%i.part" % (os.path.basename(install_path), os.getpid()),
+        )
+
+    def __stage_file(self, source_path, temporary_path):
+        """Copy the file to its temporary name next to the install path,
+        and verify the copy"""
+
+        install_directory = os.path.dirname(temporary_path)
+        if not os.path.isdir(install_directory):
+            os.makedirs(install_directory)
+
+        source_checksum = self.__copy_chunks(source_path, temporary_path)
+
+        if self.__get_checksum(temporary_path) != source_checksum:
+            raise IOError("Verification failed for %s" % temporary_path)
+
+        # Keep the file dates, just like copy2 would do
+        shutil.copystat(source_path, temporary_path)
+
+    def __copy_chunks(self, source_path, destination_path):
+        """Copy the file chunk by chunk, reporting the progress.
+        Returns the checksum of the source file."""
+
+        checksum = hashlib.sha256()
+
+        with open(source_path, "rb") as source_file:
+            with open(destination_path, "wb") as destination_file:
+                while True:
+                    if self.__cancelled.is_set():
+                        raise InstallCancelled("Installation cancelled")
+
+                    chunk = source_file.read(self.chunk_size)
+                    if not chunk:
+                        break
+
+                    checksum.update(chunk)
+                    destination_file.write(chunk)
+
+                    self.copied_bytes += len(chunk)
+                    if self.progress_callback is not None:
+                        self.progress_callback(
+                            self.copied_bytes, self.total_bytes
+                        )
+
+                # Make sure everything is on disk before verifying
+                destination_file.flush()
+                os.fsync(destination_file.fileno())
+
+        return checksum.hexdigest()
+
+    def __get_checksum(self, file_path):
+        checksum = hashlib.sha256()
+
+        with open(file_path, "rb") as checked_file:
+            while True:
+                chunk = checked_file.read(self.chunk_size)
+                if not chunk:
+                    break
+                checksum.update(chunk)
+
+        return checksum.hexdigest()
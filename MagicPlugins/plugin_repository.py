@@ -0,0 +1,474 @@
+"""
+MagicPlugins by Gilles Vink
+
+Installing plugins from a remote repository
+
+A repository is a JSON catalogue on a web server, listing the plugins
+that can be installed. The selected plugins, their icons and libraries
+are downloaded at the same time, and installed in the Internet category
+just like plugins installed by hand.
+
+The catalogue looks like this, paths are relative to the catalogue:
+
+{
+    "plugins": [
+        {
+            "name": "MagicTool",
+            "category": "Color",
+            "file": "gizmos/MagicTool.gizmo",
+            "icon": "icons/MagicTool.png",
+            "libraries": {
+                "13.2": ["13.2/MagicTool.so", "13.2/MagicTool.dll"]
+            }
+        }
+    ]
+}
+
+Downloads are kept in a local cache. Files that are already cached are
+only downloaded again when they changed on the server (using ETag and
+Last-Modified), and interrupted downloads are resumed.
+
+The catalogue comes from a server we don't control, so the names,
+categories and Nuke versions are checked before they are used in an
+install path. Nothing is ever installed outside the Internet category.
+
+"""
+
+import functools
+import hashlib
+import json
+import os
+import threading
+
+try:
+    import queue
+    from urllib.error import HTTPError
+    from urllib.parse import urljoin
+    from urllib.request import Request, urlopen
+except ImportError:
+    import Queue as queue
+    from urllib2 import HTTPError, Request, urlopen
+    from urlparse import urljoin
+
+import plugin_index
+import plugin_installer
+
+try:
+    basestring
+except NameError:
+    basestring = str
+
+
+def get_default_cache_directory():
+    cache_directory = os.path.join(
+        os.path.expanduser("~"), ".nuke", "magic_plugins_cache"
+    )
+    return cache_directory.replace(os.sep, "/")
+
+
+class PluginRepository(object):
+    """Client for a plugin repository, installing plugins into the
+    Internet category of the plugins directory."""
+
+    def __init__(
+        self,
+        url,
+        plugins_directory,
+        cache_directory=None,
+        thread_count=4,
+        timeout=30,
+        chunk_size=1024 * 1024,
+    ):
+        """url is the location of the JSON catalogue"""
+
+        if cache_directory is None:
+            cache_directory = get_default_cache_directory()
+
+        self.url = url
+        self.plugins_directory = plugins_directory
+        self.cache_directory = cache_directory
+        self.thread_count = thread_count
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+    def get_plugins(self):
+        """Return the plugins listed in the catalogue"""
+
+        with open(self.fetch(self.url), "r") as catalogue_file:
+            catalogue = json.load(catalogue_file)
+
+        return catalogue.get("plugins", [])
+
+    def install(
+        self,
+        plugin_names,
+        nuke_versions=None,
+        progress_callback=None,
+        cancelled=None,
+    ):
+        """Download the plugins with their icons and libraries, and
+        install them. By default the libraries for every Nuke version are
+        installed, like they are in the plugins directory.
+
+        Returns the install paths of all installed files."""
+
+        files = self.get_install_files(plugin_names, nuke_versions)
+
+        return self.install_files(files, progress_callback, cancelled)
+
+    def get_install_files(self, plugin_names, nuke_versions=None):
+        """Return the (url, install path) tuples of the plugins, so we
+        know what will be installed before downloading anything"""
+
+        plugins = [
+            plugin
+            for plugin in self.get_plugins()
+            if plugin.get("name") in plugin_names
+        ]
+
+        found_names = set(plugin.get("name") for plugin in plugins)
+        unknown_names = [
+            name for name in plugin_names if name not in found_names
+        ]
+        if unknown_names:
+            raise ValueError(
+                "Not found in the repository: %s" % ", ".join(unknown_names)
+            )
+
+        files = []
+        for plugin in plugins:
+            files.extend(self.__get_plugin_files(plugin, nuke_versions))
+
+        return files
+
+    def install_files(self, files, progress_callback=None, cancelled=None):
+        """Download and install the (url, install path) tuples.
+
+        The progress callback is called with a message, the amount of
+        work done and the total amount of work. Cancelled is an event
+        that stops the installation when it is set.
+
+        Returns the install paths of all installed files."""
+
+        # First download everything, so nothing is installed when one of
+        # the downloads fails
+        cached_paths = self.fetch_all(
+            [url for url, _ in files], progress_callback, cancelled
+        )
+
+        # The installer verifies every copy and renames it into place
+        errors = []
+
+        def report_progress(copied_bytes, total_bytes):
+            if cancelled is not None and cancelled.is_set():
+                installer.cancel()
+
+            if progress_callback is not None:
+                progress_callback("Installing", copied_bytes, total_bytes)
+
+        installer = plugin_installer.PluginInstaller(
+            [
+                (cached_paths.get(url), install_path)
+                for url, install_path in files
+            ],
+            progress_callback=report_progress,
+            finished_callback=errors.append,
+            chunk_size=self.chunk_size,
+        )
+        installer.run()
+
+        if errors[0] is not None:
+            raise errors[0]
+
+        return [install_path for _, install_path in files]
+
+    def fetch_all(self, urls, progress_callback=None, cancelled=None):
+        """Download all urls at the same time, returns a dictionary
+        with the cached path for every url. The progress callback is
+        called with a message, the progress and the total in per mille
+        for every downloaded chunk. Every url counts the same, because we
+        don't know the size of a file before downloading it."""
+
+        # The same file (like an icon) is only downloaded once
+        url_queue = queue.Queue()
+        for url in sorted(set(urls)):
+            url_queue.put(url)
+
+        total_count = url_queue.qsize()
+        cached_paths = {}
+        errors = []
+        lock = threading.Lock()
+
+        # The part of every url that has been downloaded, from 0 to 1
+        url_progress = {}
+
+        def report_progress(url, read_bytes, total_bytes):
+            with lock:
+                if total_bytes:
+                    url_progress[url] = min(
+                        1.0, read_bytes / float(total_bytes)
+                    )
+
+                if progress_callback is not None:
+                    progress_callback(
+                        "Downloading",
+                        int(sum(url_progress.values()) * 1000),
+                        total_count * 1000,
+                    )
+
+        def work():
+            while not errors:
+                try:
+                    url = url_queue.get_nowait()
+
+                except queue.Empty:
+                    return
+
+                try:
+                    cached_path = self.fetch(
+                        url, cancelled, functools.partial(report_progress, url)
+                    )
+
+                except plugin_installer.InstallCancelled as error:
+                    errors.append(error)
+                    return
+
+                except Exception as error:
+                    errors.append(
+                        IOError("Downloading %s failed: %s" % (url, error))
+                    )
+                    return
+
+                cached_paths[url] = cached_path
+                report_progress(url, 1, 1)
+
+        threads = [
+            threading.Thread(target=work)
+            for _ in range(min(self.thread_count, url_queue.qsize()))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+        return cached_paths
+
+    def fetch(self, url, cancelled=None, progress_callback=None):
+        """Download the url to the cache, and return the cached path.
+        When it is already cached, the server is asked if it changed.
+        A cancelled download is kept, so it can be resumed later.
+
+        The progress callback is called for every chunk with the amount
+        of bytes we have, and the size of the file when the server told
+        us (otherwise None)."""
+
+        if not os.path.isdir(self.cache_directory):
+            try:
+                os.makedirs(self.cache_directory)
+
+            # Another thread might have created it
+            except OSError:
+                if not os.path.isdir(self.cache_directory):
+                    raise
+
+        cache_key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        data_path = os.path.join(self.cache_directory, cache_key)
+        metadata_path = "%s.json" % data_path
+        part_path = "%s.part" % data_path
+        part_metadata_path = "%s.json" % part_path
+
+        metadata = {}
+        if os.path.isfile(data_path) and os.path.isfile(metadata_path):
+            with open(metadata_path, "r") as metadata_file:
+                metadata = json.load(metadata_file)
+
+        request = Request(url)
+
+        # Only download again when the file changed
+        if metadata.get("etag"):
+            request.add_header("If-None-Match", metadata.get("etag"))
+        if metadata.get("last_modified"):
+            request.add_header(
+                "If-Modified-Since", metadata.get("last_modified")
+            )
+
+        # Continue where an interrupted download stopped. With If-Range
+        # the server sends the entire file when it changed in the meantime.
+        resume_position = 0
+        if os.path.isfile(part_path) and os.path.isfile(part_metadata_path):
+            with open(part_metadata_path, "r") as part_metadata_file:
+                part_metadata = json.load(part_metadata_file)
+
+            validator = part_metadata.get("etag") or part_metadata.get(
+                "last_modified"
+            )
+            if validator:
+                resume_position = os.path.getsize(part_path)
+                request.add_header("Range", "bytes=%i-" % resume_position)
+                request.add_header("If-Range", validator)
+
+        try:
+            response = urlopen(request, timeout=self.timeout)
+
+        except HTTPError as error:
+            # Not changed, so we can use the cached file
+            if error.code == 304:
+                return data_path
+
+            # The part we have doesn't match the file anymore
+            if error.code == 416:
+                os.remove(part_path)
+                os.remove(part_metadata_path)
+                return self.fetch(url, cancelled, progress_callback)
+
+            raise
+
+        try:
+            headers = response.info()
+            metadata = {
+                "url": url,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+            }
+
+            # The server sends the entire file, so we start over. We keep
+            # the validators of this download, to be able to resume it.
+            if response.getcode() != 206:
+                resume_position = 0
+                with open(part_metadata_path, "w") as part_metadata_file:
+                    json.dump(metadata, part_metadata_file)
+
+            total_bytes = None
+            if headers.get("Content-Length"):
+                total_bytes = resume_position + int(
+                    headers.get("Content-Length")
+                )
+
+            read_bytes = resume_position
+            with open(part_path, "ab" if resume_position else "wb") as part:
+                while True:
+                    if cancelled is not None and cancelled.is_set():
+                        raise plugin_installer.InstallCancelled(
+                            "Installation cancelled"
+                        )
+
+                    chunk = response.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    part.write(chunk)
+
+                    read_bytes += len(chunk)
+                    if progress_callback is not None:
+                        progress_callback(read_bytes, total_bytes)
+
+        finally:
+            response.close()
+
+        plugin_index.replace_file(part_path, data_path)
+
+        with open(metadata_path, "w") as metadata_file:
+            json.dump(metadata, metadata_file)
+
+        os.remove(part_metadata_path)
+
+        return data_path
+
+    def __get_plugin_files(self, plugin, nuke_versions=None):
+        """Return the (url, install path) tuples for the plugin, its icon
+        and its libraries. Installed in the same place as the installer
+        dialog would."""
+
+        internet_directory = "%s/Internet" % self.plugins_directory
+        install_directory = "%s/%s" % (
+            internet_directory,
+            _get_safe_name(plugin.get("category", "Other"), "category"),
+        )
+
+        files = []
+
+        if plugin.get("file"):
+            file_name = _get_safe_name(
+                _get_file_name(plugin.get("file")), "file"
+            )
+            files.append(
+                (
+                    urljoin(self.url, plugin.get("file")),
+                    "%s/%s" % (install_directory, file_name),
+                )
+            )
+
+        for nuke_version, libraries in sorted(
+            plugin.get("libraries", {}).items()
+        ):
+            if nuke_versions is not None and nuke_version not in nuke_versions:
+                continue
+
+            version_directory = "%s/%s" % (
+                install_directory,
+                _get_safe_name(nuke_version, "Nuke version"),
+            )
+            for library in libraries:
+                files.append(
+                    (
+                        urljoin(self.url, library),
+                        "%s/%s"
+                        % (
+                            version_directory,
+                            _get_safe_name(_get_file_name(library), "file"),
+                        ),
+                    )
+                )
+
+        # The icon is named after every installed file, so it is found
+        # next to it, just like the installer dialog does
+        if plugin.get("icon"):
+            icon_paths = set(
+                "%s.png" % os.path.splitext(install_path)[0]
+                for _, install_path in files
+            )
+            for icon_path in sorted(icon_paths):
+                files.insert(
+                    0, (urljoin(self.url, plugin.get("icon")), icon_path)
+                )
+
+        # Even with safe names, a link in the plugins directory could
+        # point somewhere else
+        real_internet_directory = os.path.realpath(internet_directory)
+        for _, install_path in files:
+            if not os.path.realpath(install_path).startswith(
+                real_internet_directory + os.sep
+            ):
+                raise ValueError(
+                    "%s is not inside %s" % (install_path, internet_directory)
+                )
+
+        return files
+
+
+def _get_file_name(path):
+    """The file name of a path in the catalogue, which always uses
+    forward slashes like a url"""
+
+    return path.rsplit("/", 1)[-1]
+
+
+def _get_safe_name(name, field):
+    """Make sure a value from the catalogue can be used as a single
+    folder or file name, so it can never point outside the plugins
+    directory"""
+
+    if (
+        not isinstance(name, basestring)
+        or not name.strip()
+        or name in (".", "..")
+        or "/" in name
+        or "\\" in name
+        or ":" in name
+        or os.path.isabs(name)
+    ):
+        raise ValueError("Invalid %s in the repository: %r" % (field, name))
+
+    return name
@@ -0,0 +1,192 @@
+"""
+MagicPlugins by Gilles Vink
+
+Background read-ahead of plugin files
+
+The first time a node is created from a library, Nuke loads the (big)
+file over the network. By reading the files in the background right after
+startup, the operating system keeps them in memory and Nuke can load them
+from there. The reading is throttled, so it doesn't compete with the
+artist for the network.
+
+"""
+
+import os
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def read_file(
+    file_path, chunk_size=1024 * 1024, cancelled=None, bytes_per_second=None
+):
+    """Read the entire file, so the operating system caches it. When
+    bytes per second is provided, we never read faster than that.
+    Returns the amount of bytes read."""
+
+    read_bytes = 0
+    start_time = time.time()
+
+    try:
+        with open(file_path, "rb") as read_ahead_file:
+            # Where available, ask the operating system to start reading
+            # the file itself, which is cheaper than reading it here. It
+            # reads the entire file at full speed, so not when throttled.
+            if not bytes_per_second and hasattr(os, "posix_fadvise"):
+                try:
+                    os.posix_fadvise(
+                        read_ahead_file.fileno(), 0, 0, os.POSIX_FADV_WILLNEED
+                    )
+
+                except OSError:
+                    pass
+
+            while cancelled is None or not cancelled.is_set():
+                chunk = read_ahead_file.read(chunk_size)
+                if not chunk:
+                    break
+
+                read_bytes += len(chunk)
+
+                # Wait until we are back at the allowed rate, and always
+                # give other threads (like the UI) the chance to run
+                delay = 0.0
+                if bytes_per_second:
+                    delay = (
+                        read_bytes / float(bytes_per_second)
+                        - (time.time() - start_time)
+                    )
+
+                if cancelled is not None:
+                    cancelled.wait(max(0.0, delay))
+
+                else:
+                    time.sleep(max(0.0, delay))
+
+    # It is just a bonus, Nuke will show the error when loading it
+    except (IOError, OSError):
+        pass
+
+    return read_bytes
+
+
+def order_plugins(plugins, usage_counts=None, category_order=None):
+    """Sort the plugins, so the most used plugins come first. Or when no
+    usage is known, the plugins in the first categories of the category
+    order (like ["Internet/Keyer", "Color"]) come first."""
+
+    usage_counts = usage_counts or {}
+    category_order = category_order or []
+
+    def get_category_position(file_path):
+        for position, category in enumerate(category_order):
+            if "/%s/" % category.strip("/") in file_path:
+                return position
+
+        return len(category_order)
+
+    return sorted(
+        plugins,
+        key=lambda plugin: (
+            -usage_counts.get(plugin.get("plugin_name"), 0),
+            get_category_position(plugin.get("file_path")),
+        ),
+    )
+
+
+class ReadAhead(object):
+    """Read files in the background with a few threads, until all files
+    are read, the byte budget is used or it is cancelled."""
+
+    def __init__(
+        self,
+        file_paths,
+        byte_budget=512 * 1024 * 1024,
+        thread_count=2,
+        chunk_size=1024 * 1024,
+        bytes_per_second=None,
+    ):
+        """The files are read in the provided order. Bytes per second is
+        the maximum rate for all threads together."""
+
+        self.byte_budget = byte_budget
+        self.thread_count = thread_count
+        self.chunk_size = chunk_size
+        self.bytes_per_second = bytes_per_second
+
+        self.read_bytes = 0
+        self.reserved_bytes = 0
+
+        self.__cancelled = threading.Event()
+        self.__lock = threading.Lock()
+        self.__threads = []
+
+        self.__queue = queue.Queue()
+        for file_path in file_paths:
+            self.__queue.put(file_path)
+
+    def start(self):
+        for _ in range(self.thread_count):
+            thread = threading.Thread(target=self.__work)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def cancel(self):
+        self.__cancelled.set()
+
+    def wait(self, timeout=None):
+        """Wait for all threads, the timeout is for all of them together"""
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        for thread in self.__threads:
+            if deadline is None:
+                thread.join()
+
+            else:
+                thread.join(max(0.0, deadline - time.time()))
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self.__threads)
+
+    def __work(self):
+        while not self.__cancelled.is_set():
+            try:
+                file_path = self.__queue.get_nowait()
+
+            except queue.Empty:
+                return
+
+            # Files that don't fit the budget anymore are skipped, a
+            # smaller file later on might still fit
+            try:
+                file_size = os.path.getsize(file_path)
+
+            except OSError:
+                continue
+
+            with self.__lock:
+                if self.reserved_bytes + file_size > self.byte_budget:
+                    continue
+                self.reserved_bytes += file_size
+
+            # Every thread gets an equal part of the rate
+            bytes_per_second = None
+            if self.bytes_per_second:
+                bytes_per_second = self.bytes_per_second / float(
+                    self.thread_count
+                )
+
+            read_bytes = read_file(
+                file_path, self.chunk_size, self.__cancelled, bytes_per_second
+            )
+
+            with self.__lock:
+                self.read_bytes += read_bytes
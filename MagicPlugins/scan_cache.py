@@ -0,0 +1,386 @@
+"""
+MagicPlugins by Gilles Vink
+
+Shared scan cache for Nuke sessions starting at the same time
+
+When a lot of Nuke sessions start at once (like on a render node), every
+session would scan the same plugins directory at the same moment. With
+this cache only the first session scans, and publishes the result for
+all the other sessions on the same machine. The others wait for the
+result instead of scanning themselves.
+
+A lock file makes sure only one session scans at a time. The session
+holding the lock keeps touching it while it scans. If that session
+crashes, the lock is recovered by the others after it became stale.
+
+The published scan is only used as long as the folders of the plugins
+directory didn't change, and it is kept in a folder only the current
+user can access.
+
+"""
+
+import errno
+import getpass
+import hashlib
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+import plugin_index
+
+
+def get_default_cache_directory():
+    """A folder in the temp directory for the current user, so the scans
+    are never shared with (or changed by) other users"""
+
+    try:
+        user = getpass.getuser()
+
+    # No user name available, like in some containers
+    except Exception:
+        user = str(os.getuid()) if hasattr(os, "getuid") else "default"
+
+    safe_user = "".join(
+        character if character.isalnum() else "_" for character in user
+    )
+
+    return os.path.join(
+        tempfile.gettempdir(), "magic_plugins_%s" % safe_user
+    )
+
+
+class SharedScanCache(object):
+    """Cache the scan result in a private folder in the temp directory,
+    protected by a lock file, so simultaneous sessions share one scan."""
+
+    def __init__(
+        self,
+        plugins_directory,
+        cache_directory=None,
+        max_age=300,
+        lock_timeout=30,
+        wait_timeout=300,
+        poll_interval=0.2,
+    ):
+        """The cache is unique for every plugins directory.
+
+        max_age is the amount of seconds a published scan can be used,
+        lock_timeout the amount of seconds without the lock being touched
+        after which it is seen as stale, and wait_timeout how long we wait
+        for another session to publish its scan before scanning ourselves.
+        The lock timeout needs to be shorter than the wait timeout,
+        otherwise a stale lock is never recovered."""
+
+        if cache_directory is None:
+            cache_directory = get_default_cache_directory()
+
+        self.plugins_directory = plugins_directory
+        self.cache_directory = cache_directory
+        self.max_age = max_age
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+
+        # Every plugins directory gets its own cache files
+        directory_hash = hashlib.sha1(plugins_directory.encode("utf-8"))
+        self.cache_prefix = "magic_plugins_%s" % (
+            directory_hash.hexdigest()[:12]
+        )
+
+    def get(self, key, scan):
+        """Return the scan result for the key (like the Nuke version
+        and operating system). If no other session published it yet,
+        the scan function is called and the result published for others.
+
+        The result of the scan function needs to be JSON serializable."""
+
+        # Without a safe place to share the scan, we just scan ourselves
+        if not self.__prepare_cache_directory():
+            return scan()
+
+        cache_path = self.__get_cache_path(key)
+        lock_path = "%s.lock" % cache_path
+
+        result = self.__read(cache_path)
+        if result is not None:
+            return result
+
+        deadline = time.time() + self.wait_timeout
+
+        while True:
+            # Only an existing lock means someone else is scanning, for
+            # any other error we can't use the lock at all
+            try:
+                owner = self.__acquire_lock(lock_path)
+
+            except OSError:
+                return scan()
+
+            if owner is not None:
+                # Show the others we are still scanning, however long
+                # the scan takes
+                scanning = threading.Event()
+                heartbeat = threading.Thread(
+                    target=self.__touch_lock,
+                    args=(lock_path, owner, scanning),
+                )
+                heartbeat.daemon = True
+                heartbeat.start()
+
+                try:
+                    # Another session might have published its scan
+                    # between our read and getting the lock
+                    result = self.__read(cache_path)
+                    if result is None:
+                        # Take the fingerprint before scanning, so changes
+                        # during the scan make the published scan outdated
+                        directory_mtimes = plugin_index.get_directory_mtimes(
+                            self.plugins_directory
+                        )
+                        result = scan()
+                        self.__write(cache_path, result, directory_mtimes)
+
+                    return result
+
+                finally:
+                    scanning.set()
+                    heartbeat.join()
+                    self.__release_lock(lock_path, owner)
+
+            # Someone else is scanning, if it is still alive wait for
+            # the published result
+            stale_owner = self.__get_stale_owner(lock_path)
+            if stale_owner is not None:
+                self.__release_lock(lock_path, stale_owner)
+                continue
+
+            time.sleep(self.poll_interval)
+
+            result = self.__read(cache_path)
+            if result is not None:
+                return result
+
+            # We don't want to wait forever, just scan ourselves
+            if time.time() > deadline:
+                return scan()
+
+    def __get_cache_path(self, key):
+        # Make sure the key can be used in a file name
+        safe_key = "".join(
+            character if character.isalnum() else "_" for character in key
+        )
+        cache_name = "%s_%s.json" % (self.cache_prefix, safe_key)
+
+        return os.path.join(self.cache_directory, cache_name)
+
+    def __prepare_cache_directory(self):
+        """Create the cache folder, only accessible by the current user.
+        Returns False when the folder exists but isn't safe to use."""
+
+        try:
+            os.mkdir(self.cache_directory, 0o700)
+
+        except OSError as error:
+            if error.errno != errno.EEXIST:
+                return False
+
+        try:
+            directory_stat = os.lstat(self.cache_directory)
+
+        except OSError:
+            return False
+
+        # Someone else could have created the folder (or a link to
+        # another folder) before us, so we make sure it is ours
+        if os.name == "posix":
+            return (
+                not os.path.islink(self.cache_directory)
+                and directory_stat.st_uid == os.getuid()
+                and directory_stat.st_mode & 0o077 == 0
+            )
+
+        return os.path.isdir(self.cache_directory)
+
+    def __read(self, cache_path):
+        """Read the published scan, returns None if there is no
+        (valid) scan available"""
+
+        try:
+            with open(cache_path, "r") as cache_file:
+                cache_stat = os.fstat(cache_file.fileno())
+
+                # Only trust scans published by ourselves
+                if os.name == "posix" and cache_stat.st_uid != os.getuid():
+                    return None
+
+                if time.time() - cache_stat.st_mtime > self.max_age:
+                    return None
+
+                cache = json.load(cache_file)
+
+        # Not published yet, or not readable
+        except (OSError, IOError, ValueError):
+            return None
+
+        # A plugin has been added or removed since the scan
+        if not plugin_index.directories_match(
+            self.plugins_directory, cache.get("directories") or {}
+        ):
+            return None
+
+        return cache.get("result")
+
+    def __write(self, cache_path, result, directory_mtimes):
+        """Publish the scan with the fingerprint of the plugins directory.
+        We write to a temporary file first and rename it, so other
+        sessions will never read a half written file."""
+
+        temporary_path = None
+
+        try:
+            cache_descriptor, temporary_path = tempfile.mkstemp(
+                suffix=".tmp", dir=self.cache_directory
+            )
+            with os.fdopen(cache_descriptor, "w") as cache_file:
+                json.dump(
+                    {
+                        "created": time.time(),
+                        "directories": directory_mtimes,
+                        "result": result,
+                    },
+                    cache_file,
+                )
+
+            plugin_index.replace_file(temporary_path, cache_path)
+
+        # Publishing is a bonus, we still have our own scan
+        except (OSError, IOError):
+            if temporary_path is not None and os.path.isfile(temporary_path):
+                os.remove(temporary_path)
+
+    @staticmethod
+    def __acquire_lock(lock_path):
+        """Create the lock file, this will fail if it already exists
+        so only one session can hold the lock. Returns the owner written
+        in the lock, or None when someone else holds the lock."""
+
+        try:
+            lock_file = os.open(
+                lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600
+            )
+
+        except OSError as error:
+            if error.errno == errno.EEXIST:
+                return None
+            raise
+
+        # Save who owns the lock, so we can check if it is still alive.
+        # The unique part tells our lock apart from a later one by the
+        # same process.
+        owner = "%s %i %s" % (
+            socket.gethostname(),
+            os.getpid(),
+            uuid.uuid4().hex,
+        )
+        try:
+            os.write(lock_file, owner.encode("utf-8"))
+
+        finally:
+            os.close(lock_file)
+
+        return owner
+
+    @staticmethod
+    def __release_lock(lock_path, owner):
+        """Remove the lock, but only when it is still the lock of the
+        owner. Another session might have recovered the lock in the
+        meantime, and we don't want to remove their lock."""
+
+        # Renaming is atomic, so only one session can take the lock away
+        released_path = "%s.%s.released" % (lock_path, uuid.uuid4().hex)
+        try:
+            os.rename(lock_path, released_path)
+
+        # The lock is removed already
+        except OSError:
+            return
+
+        try:
+            with open(released_path, "r") as lock_file:
+                released_owner = lock_file.read()
+
+        except (OSError, IOError):
+            released_owner = None
+
+        # We took someone else's lock, put it back if nobody created a new
+        # lock in the meantime
+        if released_owner != owner and not os.path.exists(lock_path):
+            try:
+                os.rename(released_path, lock_path)
+                return
+
+            except OSError:
+                pass
+
+        try:
+            os.remove(released_path)
+
+        except OSError:
+            pass
+
+    def __touch_lock(self, lock_path, owner, scanning):
+        """Update the modification time of our lock until the scan is
+        done, so it never becomes stale while we are still scanning"""
+
+        while not scanning.wait(self.lock_timeout / 3.0):
+            try:
+                with open(lock_path, "r") as lock_file:
+                    if lock_file.read() != owner:
+                        return
+
+                os.utime(lock_path, None)
+
+            # The lock has been recovered by someone else
+            except (OSError, IOError):
+                return
+
+    def __get_stale_owner(self, lock_path):
+        """A lock is stale when the session holding it doesn't exist
+        anymore. When we can't check that, it is stale when it hasn't
+        been touched for longer than the lock timeout.
+        Returns the owner of a stale lock, or None."""
+
+        try:
+            lock_age = time.time() - os.stat(lock_path).st_mtime
+
+            with open(lock_path, "r") as lock_file:
+                owner = lock_file.read()
+
+            hostname, pid = owner.split()[:2]
+
+        # The lock is removed already or still being written
+        except (OSError, IOError, ValueError):
+            return None
+
+        # We can only check processes on our own machine, and checking
+        # with signal 0 is only safe on Unix based systems
+        if os.name != "posix" or hostname != socket.gethostname():
+            if lock_age > self.lock_timeout:
+                return owner
+
+            return None
+
+        try:
+            os.kill(int(pid), 0)
+
+        except OSError as error:
+            # EPERM means the process exists, but is owned by someone else
+            if error.errno != errno.EPERM:
+                return owner
+
+        return None
+